@@ -0,0 +1,92 @@
+# Editor pages (/new-post, /edit-post/<id>). The blueprint itself is cheap to register; the form classes,
+# flask_wtf and flask_ckeditor are only imported by the first request to one of its pages, so read-only
+# workers and cold starts never load them.
+from datetime import date
+from flask import Blueprint, Flask, current_app, flash, redirect, url_for, abort
+import metrics
+from storage import ConflictError
+
+_ckeditor = None
+
+
+# CKEditor is normally set up at startup, which a running app no longer allows. Setting it up on a scratch app
+# gives its config defaults and template helper without touching the real app; the editor is loaded from its CDN.
+def ckeditor():
+    global _ckeditor
+    if _ckeditor is None:
+        from flask_ckeditor import CKEditor
+        scratch = Flask(__name__)
+        CKEditor(scratch)
+        for key, value in scratch.config.items():
+            if key.startswith("CKEDITOR_"):
+                current_app.config.setdefault(key, value)
+        _ckeditor = scratch.extensions["ckeditor"]
+    return _ckeditor
+
+
+# `render(template, **context)` renders a template, `writer` is the PostWriter edits go through
+def admin_blueprint(store, writer, render) -> Blueprint:
+    admin = Blueprint("admin", __name__)
+
+    def render_editor(form, **context):
+        return render("make-post.html", form=form, ckeditor=ckeditor(), **context)
+
+    @admin.route("/new-post", methods=["GET", "POST"])
+    def add_new_post():
+        from forms import CreatePostForm
+        form = CreatePostForm()
+        if form.validate_on_submit():
+
+            new_post_data = {
+                "title": form.title.data,
+                "subtitle": form.subtitle.data,
+                "date": date.today().strftime("%B %d, %Y"),
+                "author": form.author.data,
+                "image_url": form.img_url.data,
+                "body": form.body.data,
+            }
+
+            post = writer.create(new_post_data)
+            flash(f"Post saved with id {post.id}.")
+
+            return redirect(url_for("get_all_posts"))
+        return render_editor(form)
+
+    @admin.route("/edit-post/<int:post_id>", methods=["GET", "POST"])
+    def edit_post(post_id):
+        from forms import CreatePostForm
+        with metrics.phase("lookup"):
+            # Another worker may have saved this post since this one last looked at the journal
+            writer.sync()
+            post = store.get_by_id(post_id)
+        if post is None:
+            abort(404)
+        form = CreatePostForm(
+            title=post.title,
+            subtitle=post.subtitle,
+            img_url=post.image_url,
+            author=post.author,
+            body=post.body,
+            revision=writer.revision(post_id),
+        )
+        if form.validate_on_submit():
+            try:
+                writer.update(
+                    post,
+                    expected_revision=form.revision.data,
+                    title=form.title.data,
+                    subtitle=form.subtitle.data,
+                    image_url=form.img_url.data,
+                    author=form.author.data,
+                    body=form.body.data,
+                )
+            except ConflictError:
+                # Someone saved this post after the form was loaded, don't overwrite their changes
+                flash("This post was changed in the meantime. Reload the page to edit the latest version.")
+                return render_editor(form, is_edit=True)
+
+            flash("Post saved.")
+            return redirect(url_for("get_all_posts"))
+        return render_editor(form, is_edit=True)
+
+    return admin
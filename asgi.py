@@ -0,0 +1,322 @@
+# ASGI entry point for the read path: `uvicorn asgi:app`.
+# `/`, `/<post_title>` and static files are answered by async handlers over the same PostStore and page cache
+# as the Flask app, with bodies streamed in chunks. Everything else (page cache misses, forms, search,
+# image variants) runs through the Flask app in a thread, so rendering never blocks the event loop.
+import asyncio
+import io
+import logging
+import math
+import mimetypes
+import os
+import sys
+import time
+from datetime import datetime, timezone
+from urllib.parse import parse_qs
+from werkzeug.exceptions import HTTPException, NotFound, TooManyRequests
+from werkzeug.http import http_date, is_resource_modified, parse_accept_header, parse_cookie
+from werkzeug.routing import RequestRedirect
+from werkzeug.security import safe_join
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+# The snapshot is refreshed on the event loop (see lifespan) instead of in main's background thread
+os.environ.setdefault("SNAPSHOT_SHARED", "1")
+
+import main  # noqa: E402
+import metrics  # noqa: E402
+from snapshot import SnapshotRefresher, release_memory  # noqa: E402
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 64 * 1024
+PAGE_MAX_AGE = int(os.getenv("PAGE_MAX_AGE", 60))
+
+
+# Runs a SnapshotRefresher on the event loop. The fetch goes through httpx if it's installed, otherwise the blocking fetch runs in a thread; parsing and swapping the store never block the loop.
+class AsyncSnapshotRefresher:
+    def __init__(self, refresher: SnapshotRefresher):
+        self.refresher = refresher
+        self._task = None
+
+    async def refresh(self) -> bool:
+        refresher = self.refresher
+        if httpx is None:
+            return await asyncio.to_thread(refresher.refresh)
+        connect, read = refresher.timeout
+        with metrics.timed(metrics.SNAPSHOT_FETCH_SECONDS):
+            async with httpx.AsyncClient(timeout=httpx.Timeout(read, connect=connect)) as client:
+                response = await client.get(refresher.url, headers=refresher.request_headers())
+            if response.status_code != 304:
+                response.raise_for_status()
+            refresher.fetched_at = time.time()
+            changed = response.status_code != 304 and \
+                await asyncio.to_thread(refresher.load, response.content, response.headers.get("ETag"))
+        del response
+        if changed:
+            release_memory()
+        return changed
+
+    async def refresh_with_retry(self) -> bool:
+        refresher = self.refresher
+        for attempt in range(refresher.retries):
+            try:
+                return await self.refresh()
+            except Exception:
+                metrics.SNAPSHOT_FETCH_ERRORS.inc()
+                if attempt == refresher.retries - 1:
+                    raise
+                logger.warning("Snapshot fetch failed (attempt %d/%d)", attempt + 1, refresher.retries)
+                await asyncio.sleep(refresher.backoff * 2 ** attempt)
+        return False
+
+    # Same schedule as SnapshotRefresher.start, as a task on the running loop
+    def start(self):
+        if self._task is not None or self.refresher.interval < 0:
+            return
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await self.refresh_with_retry()
+            except Exception:
+                logger.exception("Snapshot refresh failed, keeping the current one")
+            if self.refresher.interval <= 0:
+                return
+            await asyncio.sleep(self.refresher.interval)
+
+
+refresher = AsyncSnapshotRefresher(main.refresher)
+url_adapter = main.app.url_map.bind("localhost")
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        await lifespan(receive, send)
+    elif scope["type"] == "http":
+        environ = await wsgi_environ(scope, receive)
+        response = None
+        if environ["REQUEST_METHOD"] in ("GET", "HEAD"):
+            response = await fast_path(scope["path"], environ)
+        if response is None:
+            response = await call_flask(environ)
+        await send_response(send, environ, *response)
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            refresher.start()
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await refresher.stop()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+# (status, headers, body chunks) for the requests served without Flask, None for everything else
+async def fast_path(path: str, environ):
+    start = time.perf_counter()
+    try:
+        endpoint, arguments = url_adapter.match(path, environ["REQUEST_METHOD"])
+    except (HTTPException, RequestRedirect):
+        return None
+    if endpoint == "static":
+        response = await static_file(environ, arguments["filename"])
+        return served(response, start, endpoint, environ)
+    wait = main.rate_limited(endpoint, environ)
+    if wait:
+        return served(error(TooManyRequests(retry_after=math.ceil(wait))), start, endpoint, environ)
+
+    if endpoint == "get_all_posts":
+        # Pending flash messages live in the session and make the page uncacheable, leave those to Flask
+        if main.app.config["SESSION_COOKIE_NAME"] in parse_cookie(environ.get("HTTP_COOKIE", "")):
+            return None
+        query = parse_qs(environ["QUERY_STRING"])
+        try:
+            page = main.paginator.after(int(query["after"][0])) if "after" in query else \
+                main.paginator.page(int(query.get("page", ["1"])[0]))
+        except ValueError:
+            return None
+        if page is None:
+            return served(error(NotFound()), start, endpoint, environ)
+        key = ("index", page.number, page.posts[0].id if page.posts else None)
+    elif endpoint == "show_post":
+        slug = arguments["post_title"]
+        if main.missing_slugs.has(slug, main.post_store.version):
+            return served(error(NotFound()), start, endpoint, environ)
+        post = main.post_store.get_by_slug(slug)
+        if post is None:
+            return None
+        key = ("post", main.post_store.slug_for(post))
+    else:
+        return None
+
+    page = main.page_cache.get(key, main.post_store.version, count_miss=False)
+    if page is None:
+        return None
+    body, encoding, etag = page.negotiate(parse_accept_header(environ.get("HTTP_ACCEPT_ENCODING")))
+    headers = [
+        ("Content-Type", "text/html; charset=utf-8"),
+        ("Vary", "Accept-Encoding"),
+        ("ETag", f'"{etag}"'),
+        ("Last-Modified", http_date(page.last_modified)),
+        ("Cache-Control", f"public, max-age={PAGE_MAX_AGE}"),
+        ("X-Cache", "HIT"),
+    ]
+    if encoding:
+        headers.append(("Content-Encoding", encoding))
+    if not is_resource_modified(environ, etag, last_modified=utc(page.last_modified)):
+        return served((304, headers, ()), start, endpoint, environ)
+    headers.append(("Content-Length", str(len(body))))
+    return served((200, headers, chunked(body)), start, endpoint, environ)
+
+
+# Same request metrics and Server-Timing header as the Flask app
+def served(response, start: float, endpoint: str, environ):
+    if response is not None:
+        status, headers, _ = response
+        headers.append(("Server-Timing", metrics.finish_request(
+            time.perf_counter() - start, endpoint, environ["REQUEST_METHOD"], status)))
+    return response
+
+
+def error(exception: HTTPException):
+    return exception.code, list(exception.get_headers()), [exception.get_body().encode()]
+
+
+def utc(timestamp: float) -> datetime:
+    return datetime.fromtimestamp(timestamp, timezone.utc)
+
+
+def chunked(body: bytes):
+    view = memoryview(body)
+    for start in range(0, len(body), CHUNK_SIZE):
+        yield bytes(view[start:start + CHUNK_SIZE])
+
+
+# Files under static/, read in chunks off the event loop. Same validators as Flask's static route.
+async def static_file(environ, filename: str):
+    path = safe_join(main.app.static_folder, filename)
+    try:
+        stat = os.stat(path) if path else None
+    except OSError:
+        stat = None
+    if stat is None or not os.path.isfile(path):
+        return None
+    etag = f"{stat.st_mtime}-{stat.st_size}"
+    headers = [
+        ("Content-Type", mimetypes.guess_type(filename)[0] or "application/octet-stream"),
+        ("ETag", f'"{etag}"'),
+        ("Last-Modified", http_date(stat.st_mtime)),
+        ("Cache-Control", "no-cache"),
+    ]
+    if not is_resource_modified(environ, etag, last_modified=utc(stat.st_mtime)):
+        return 304, headers, ()
+    headers.append(("Content-Length", str(stat.st_size)))
+    return 200, headers, read_file(path)
+
+
+async def read_file(path: str):
+    file = await asyncio.to_thread(open, path, "rb")
+    try:
+        while chunk := await asyncio.to_thread(file.read, CHUNK_SIZE):
+            yield chunk
+    finally:
+        file.close()
+
+
+async def call_flask(environ):
+    result = {}
+
+    def start_response(status, headers, exc_info=None):
+        result["status"] = int(status.split(" ", 1)[0])
+        result["headers"] = headers
+
+    def run():
+        iterable = main.app(environ, start_response)
+        return iter(iterable), iterable
+
+    iterator, iterable = await asyncio.to_thread(run)
+    return result["status"], result["headers"], wsgi_chunks(iterator, iterable)
+
+
+# The response iterable can be a file (send_file), so it's consumed chunk by chunk in a thread as well
+async def wsgi_chunks(iterator, iterable):
+    try:
+        while (chunk := await asyncio.to_thread(next, iterator, None)) is not None:
+            if chunk:
+                yield chunk
+    finally:
+        if hasattr(iterable, "close"):
+            await asyncio.to_thread(iterable.close)
+
+
+async def wsgi_environ(scope, receive) -> dict:
+    body = bytearray()
+    while True:
+        message = await receive()
+        body += message.get("body", b"")
+        if not message.get("more_body"):
+            break
+    server = scope.get("server") or ("localhost", 80)
+    client = scope.get("client") or ("", 0)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode().decode("latin-1"),
+        # WSGI wants the utf-8 bytes of the path as latin-1, ASGI has it decoded already
+        "PATH_INFO": scope["path"].encode().decode("latin-1"),
+        "QUERY_STRING": scope["query_string"].decode("latin-1"),
+        "SERVER_NAME": server[0],
+        "SERVER_PORT": str(server[1]),
+        "SERVER_PROTOCOL": f"HTTP/{scope['http_version']}",
+        "REMOTE_ADDR": client[0],
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(bytes(body)),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+        "CONTENT_LENGTH": str(len(body)),
+    }
+    for name, value in scope["headers"]:
+        name = name.decode("latin-1").upper().replace("-", "_")
+        value = value.decode("latin-1")
+        if name == "CONTENT_TYPE":
+            environ["CONTENT_TYPE"] = value
+        elif name != "CONTENT_LENGTH":
+            key = f"HTTP_{name}"
+            environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+async def send_response(send, environ, status: int, headers, chunks):
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(name.encode("latin-1"), value.encode("latin-1")) for name, value in headers],
+    })
+    head = environ["REQUEST_METHOD"] == "HEAD"
+    if hasattr(chunks, "__aiter__"):
+        async for chunk in chunks:
+            if not head:
+                await send({"type": "http.response.body", "body": chunk, "more_body": True})
+    else:
+        for chunk in chunks:
+            if not head:
+                await send({"type": "http.response.body", "body": chunk, "more_body": True})
+    await send({"type": "http.response.body", "body": b""})
@@ -0,0 +1,93 @@
+# Measures time-to-first-request of a fresh `import main` with the n:point bin stubbed as slow, failing and healthy.
+# Usage: python benchmarks/cold_start.py [--runs 5]
+import argparse
+import http.server
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+FIRST_REQUEST = """
+import time
+start = time.perf_counter()
+import main
+response = main.app.test_client().get("/")
+assert response.status_code == 200, response.status_code
+print(time.perf_counter() - start)
+"""
+
+
+def stub_server(mode: str, delay: float):
+    with open(os.path.join(ROOT, "static/assets/backup.json"), "rb") as file:
+        payload = file.read()
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            if mode == "slow":
+                time.sleep(delay)
+            if mode == "failing":
+                self.send_response(500)
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.end_headers()
+            try:
+                self.wfile.write(payload)
+            except (BrokenPipeError, ConnectionResetError):
+                # The client gave up on a slow response
+                pass
+
+        def log_message(self, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def time_to_first_request(url: str, cache_dir: str) -> float:
+    env = dict(os.environ, NPOINT_URL=url, SNAPSHOT_CACHE_DIR=cache_dir, SECRET_KEY="benchmark")
+    output = subprocess.run([sys.executable, "-c", FIRST_REQUEST], cwd=ROOT, env=env, check=True,
+                            capture_output=True, text=True).stdout
+    return float(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--delay", type=float, default=30, help="response delay of the slow stub in seconds")
+    args = parser.parse_args()
+
+    results = {}
+    for mode in ("healthy", "slow", "failing"):
+        server = stub_server(mode, args.delay)
+        url = f"http://127.0.0.1:{server.server_port}/"
+        for cache in ("cold", "warm"):
+            with tempfile.TemporaryDirectory() as cache_dir:
+                if cache == "warm":
+                    # Let one process reconcile with the healthy payload so the next boots find a snapshot cache
+                    warm_server = stub_server("healthy", 0)
+                    env = dict(os.environ, NPOINT_URL=f"http://127.0.0.1:{warm_server.server_port}/",
+                               SNAPSHOT_CACHE_DIR=cache_dir, SECRET_KEY="benchmark")
+                    subprocess.run([sys.executable, "-c", "import main; main.refresher.stop()"],
+                                   cwd=ROOT, env=env, check=True, capture_output=True)
+                    warm_server.shutdown()
+                timings = [time_to_first_request(url, cache_dir) for _ in range(args.runs)]
+            results[f"{mode}/{cache}"] = timings
+            print(f"{mode:>8} remote, {cache} cache: median {statistics.median(timings) * 1000:8.1f} ms, "
+                  f"max {max(timings) * 1000:8.1f} ms")
+        server.shutdown()
+
+    print(json.dumps(results))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+# Compares two result files of benchmarks/routes.py and flags changes beyond a threshold.
+# Usage: python benchmarks/compare.py benchmarks/results/<old>.json benchmarks/results/<new>.json [--threshold 10]
+# Exits with status 1 if anything got slower or bigger by more than the threshold.
+import argparse
+import json
+
+# Metrics where a larger value is better, everything else (times, memory, bytes) should go down
+HIGHER_IS_BETTER = ("requests/s",)
+
+
+def flatten(values: dict, prefix: str = "") -> dict:
+    flat = {}
+    for name, value in values.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, f"{prefix}{name} / "))
+        else:
+            flat[f"{prefix}{name}"] = value
+    return flat
+
+
+def run():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("old")
+    parser.add_argument("new")
+    parser.add_argument("--threshold", type=float, default=10, help="percent change reported as a regression")
+    args = parser.parse_args()
+
+    with open(args.old) as file:
+        old = json.load(file)
+    with open(args.new) as file:
+        new = json.load(file)
+    print(f"{old['commit']} -> {new['commit']}")
+
+    regressions = 0
+    for size in new["sizes"]:
+        if size not in old["sizes"]:
+            continue
+        print(f"\n{size} posts")
+        before, after = flatten(old["sizes"][size]), flatten(new["sizes"][size])
+        for name, value in after.items():
+            if name not in before or not before[name]:
+                continue
+            change = (value - before[name]) / before[name] * 100
+            worse = -change if name.endswith(HIGHER_IS_BETTER) else change
+            flag = "  REGRESSION" if worse > args.threshold else ""
+            regressions += bool(flag)
+            print(f"  {name:<52} {before[name]:>12} -> {value:>12} {change:+7.1f}%{flag}")
+    raise SystemExit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    run()
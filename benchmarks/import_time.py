@@ -0,0 +1,74 @@
+# Import-time profile of the app from `python -X importtime`: the time to `import main`, the packages it pulls in
+# sorted by cumulative import time, and which of the lazily imported ones (editor forms, requests, httpx, Pillow)
+# were loaded anyway. Every run is a fresh process; the median of the runs is reported.
+# Usage: python benchmarks/import_time.py [--runs 5] [--top 15] [--json results.json]
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Only needed by the editor pages, n:point fetches or image variants, so none of them should be imported on boot
+LAZY = ("forms", "flask_wtf", "flask_ckeditor", "requests", "httpx", "PIL")
+
+
+# {module: (self us, cumulative us)} of one `import main`
+def profile() -> dict:
+    with tempfile.TemporaryDirectory() as cache_dir:
+        env = dict(os.environ, SNAPSHOT_CACHE_DIR=cache_dir, NPOINT_REFRESH_INTERVAL="-1", SECRET_KEY="benchmark",
+                   JOURNAL_PATH=os.path.join(cache_dir, "journal.jsonl"), PYTHONWARNINGS="ignore")
+        stderr = subprocess.run([sys.executable, "-X", "importtime", "-c", "import main"], cwd=ROOT, env=env,
+                                check=True, capture_output=True, text=True).stderr
+    modules = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        own, cumulative, name = line[len("import time:"):].split("|")
+        modules[name.strip()] = (int(own), int(cumulative))
+    return modules
+
+
+def top_level(name: str) -> str:
+    return name.split(".")[0]
+
+
+def run():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    runs = [profile() for _ in range(args.runs)]
+    # Cumulative time per top-level package: the largest cumulative entry of it in each run
+    packages = {}
+    for modules in runs:
+        per_run = {}
+        for name, (_, cumulative) in modules.items():
+            package = top_level(name)
+            per_run[package] = max(per_run.get(package, 0), cumulative)
+        for package, cumulative in per_run.items():
+            packages.setdefault(package, []).append(cumulative)
+
+    total = statistics.median(modules["main"][1] for modules in runs) / 1000
+    ranked = sorted(((statistics.median(times) / 1000, package) for package, times in packages.items()
+                     if package != "main"), reverse=True)
+    loaded = sorted({top_level(name) for modules in runs for name in modules} & set(LAZY))
+
+    print(f"import main: {total:.1f} ms (median of {args.runs})")
+    for ms, package in ranked[:args.top]:
+        print(f"  {package:<24} {ms:8.1f} ms")
+    print(f"lazy modules imported on boot: {', '.join(loaded) or 'none'}")
+
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump({"import main ms": round(total, 1), "lazy imported": loaded,
+                       "packages ms": {package: round(ms, 1) for ms, package in ranked}}, file, indent=2)
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,134 @@
+# Compares requests/s and latency of the sync (gunicorn main:app) and async (uvicorn asgi:app) modes
+# at high concurrency, on a synthetic archive. Requests cycle through index pages, post pages and uploads.
+# Usage: python benchmarks/load_test.py [--posts 3000] [--workers 4] [--concurrency 256] [--seconds 10]
+import argparse
+import asyncio
+import os
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from concurrent.futures import ProcessPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from snapshot import compact, save_cached  # noqa: E402
+from store import slugify  # noqa: E402
+from synthetic import generate_posts  # noqa: E402
+
+SERVERS = {
+    "sync": lambda workers, port: ["gunicorn", "-c", os.path.join(ROOT, "gunicorn.conf.py"), "-w", str(workers),
+                                   "-b", f"127.0.0.1:{port}", "main:app"],
+    "async": lambda workers, port: ["uvicorn", "--workers", str(workers), "--port", str(port),
+                                    "--log-level", "warning", "asgi:app"],
+}
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def fetch(port: int, path: str) -> int:
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(f"GET {path} HTTP/1.1\r\nHost: 127.0.0.1\r\nAccept-Encoding: gzip\r\nConnection: close\r\n\r\n".encode())
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    return int(response.split(b" ", 2)[1])
+
+
+# One load generating process: `concurrency` connections in a loop for `seconds`, returns (latencies, errors)
+def generate(port: int, paths: list, concurrency: int, seconds: float) -> tuple:
+    async def client(offset: int, deadline: float, latencies: list, errors: list):
+        i = offset
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            try:
+                status = await fetch(port, paths[i % len(paths)])
+            except OSError:
+                status = None
+            if status == 200:
+                latencies.append(time.perf_counter() - start)
+            else:
+                errors.append(status)
+            i += 1
+
+    async def main():
+        latencies, errors = [], []
+        deadline = time.perf_counter() + seconds
+        await asyncio.gather(*(client(i * 7, deadline, latencies, errors) for i in range(concurrency)))
+        return latencies, errors
+
+    return asyncio.run(main())
+
+
+def measure(mode: str, args, cache_dir: str, paths: list) -> dict:
+    port = free_port()
+    env = dict(os.environ, SNAPSHOT_CACHE_DIR=cache_dir, NPOINT_REFRESH_INTERVAL="-1", SECRET_KEY="benchmark",
+               JOURNAL_PATH=os.path.join(cache_dir, "journal.jsonl"))
+    server = subprocess.Popen([sys.executable, "-m"] + SERVERS[mode](args.workers, port), cwd=ROOT, env=env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        for _ in range(600):
+            try:
+                urllib.request.urlopen(f"http://127.0.0.1:{port}/", timeout=5).read()
+                break
+            except OSError:
+                time.sleep(0.1)
+        # Render every page once in every worker, so both modes are measured on a warm page cache
+        for _ in range(args.workers * 2):
+            for path in paths:
+                urllib.request.urlopen(f"http://127.0.0.1:{port}{path}", timeout=30).read()
+
+        per_process = max(1, args.concurrency // args.clients)
+        with ProcessPoolExecutor(args.clients) as pool:
+            results = list(pool.map(generate, [port] * args.clients, [paths] * args.clients,
+                                    [per_process] * args.clients, [args.seconds] * args.clients))
+        latencies = sorted(latency for result in results for latency in result[0])
+        errors = sum(len(result[1]) for result in results)
+        return {
+            "requests/s": len(latencies) / args.seconds,
+            "p50 ms": statistics.median(latencies) * 1000,
+            "p99 ms": statistics.quantiles(latencies, n=100)[98] * 1000,
+            "errors": errors,
+        }
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def run():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--posts", type=int, default=3000)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--concurrency", type=int, default=256)
+    parser.add_argument("--clients", type=int, default=4, help="load generating processes")
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--modes", nargs="+", default=list(SERVERS), choices=list(SERVERS))
+    args = parser.parse_args()
+
+    posts = generate_posts(args.posts)
+    uploads = sorted(os.listdir(os.path.join(ROOT, "static", "uploads")))[:10]
+    paths = [f"/?page={page}" for page in range(1, 11)] + [f"/{slugify(post['title'])}" for post in posts[:100]] + \
+        [f"/static/uploads/{name}" for name in uploads]
+
+    cache_dir = tempfile.mkdtemp()
+    try:
+        save_cached(compact(posts), os.path.join(cache_dir, "snapshot.json"))
+        for mode in args.modes:
+            result = measure(mode, args, cache_dir, paths)
+            print(f"{mode:>5}: {result['requests/s']:8.0f} req/s, p50 {result['p50 ms']:7.1f} ms, "
+                  f"p99 {result['p99 ms']:7.1f} ms, {result['errors']} errors")
+    finally:
+        shutil.rmtree(cache_dir)
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,94 @@
+# Parse time and memory of loading a bin with each installed JSON library (stdlib json, orjson, msgspec),
+# on synthetic dumps. Every library and size runs in a fresh process: the time of schema.decode_posts,
+# its peak memory, and the memory still held once the posts are in a PostStore.
+# Usage: python benchmarks/parse.py [--sizes 10000 100000] [--runs 3]
+import argparse
+import gc
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import schema  # noqa: E402
+from synthetic import generate_posts  # noqa: E402
+
+PARSERS = ("json", "orjson", "msgspec")
+
+
+def rss_mib() -> float:
+    with open("/proc/self/status") as file:
+        for line in file:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+# Runs in the per-parser process
+def measure(parser: str, path: str, runs: int) -> dict:
+    if parser != "msgspec":
+        schema.msgspec = None
+    if parser == "json":
+        schema.orjson = None
+    from snapshot import release_memory
+    from store import PostStore
+
+    release_memory()
+    before = rss_mib()
+    with open(path, "rb") as file:
+        payload = file.read()
+    start = time.perf_counter()
+    posts = schema.decode_posts(payload)
+    first = time.perf_counter() - start
+    # ru_maxrss is the peak of the whole process, so this includes the payload itself
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 - before
+
+    timings = [first]
+    for _ in range(runs - 1):
+        start = time.perf_counter()
+        schema.decode_posts(payload)
+        timings.append(time.perf_counter() - start)
+
+    with tempfile.TemporaryDirectory() as body_dir:
+        del payload
+        store = PostStore(posts, body_dir=body_dir)
+        del posts
+        gc.collect()
+        release_memory()
+        held = rss_mib() - before
+        assert store.posts
+    return {"parse ms": round(min(timings) * 1000, 1), "peak MiB": round(peak, 1), "store MiB": round(held, 1)}
+
+
+def run():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000])
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--measure", nargs=2, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure:
+        print(json.dumps(measure(args.measure[0], args.measure[1], args.runs)))
+        return
+
+    available = [name for name in PARSERS if name == "json" or getattr(schema, name) is not None]
+    for size in args.sizes:
+        with tempfile.NamedTemporaryFile(suffix=".json") as dump:
+            dump.write(json.dumps(generate_posts(size)).encode())
+            dump.flush()
+            print(f"{size} posts, {os.path.getsize(dump.name) / 1024 / 1024:.0f} MiB")
+            for name in available:
+                output = subprocess.run([sys.executable, __file__, "--measure", name, dump.name, "--runs",
+                                         str(args.runs)], check=True, capture_output=True, text=True).stdout
+                result = json.loads(output)
+                print(f"  {name:>8}: parse {result['parse ms']:8.1f} ms, peak {result['peak MiB']:7.1f} MiB, "
+                      f"held in the store {result['store MiB']:6.1f} MiB")
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,51 @@
+# Compares bytes transferred and latency of first and repeat visits to every post page,
+# with and without compression and conditional requests.
+# Usage: python benchmarks/repeat_visits.py [--rounds 200]
+import argparse
+import os
+import statistics
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+# Keep the background reconcile off the network
+os.environ.setdefault("NPOINT_URL", "http://127.0.0.1:9/")
+os.environ.setdefault("SECRET_KEY", "benchmark")
+
+import main  # noqa: E402
+
+SCENARIOS = {
+    "plain": lambda etag: {},
+    "gzip/br": lambda etag: {"Accept-Encoding": "gzip, br"},
+    "repeat (If-None-Match)": lambda etag: {"Accept-Encoding": "gzip, br", "If-None-Match": etag},
+}
+
+
+def run():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rounds", type=int, default=200)
+    args = parser.parse_args()
+
+    client = main.app.test_client()
+    urls = [f"/{main.post_store.slug_for(post)}" for post in main.post_store.posts]
+    etags = {url: client.get(url, headers={"Accept-Encoding": "gzip, br"}).headers["ETag"] for url in urls}
+
+    for name, headers in SCENARIOS.items():
+        timings = []
+        transferred = 0
+        for _ in range(args.rounds):
+            for url in urls:
+                start = time.perf_counter()
+                response = client.get(url, headers=headers(etags[url]))
+                timings.append(time.perf_counter() - start)
+                transferred += len(response.data)
+        requests_made = args.rounds * len(urls)
+        print(f"{name:>24}: {transferred / requests_made:9.0f} bytes/request, "
+              f"median {statistics.median(timings) * 1e6:7.0f} us, "
+              f"p99 {statistics.quantiles(timings, n=100)[98] * 1e6:7.0f} us")
+
+
+if __name__ == "__main__":
+    run()
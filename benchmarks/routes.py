@@ -0,0 +1,164 @@
+# Benchmarks the Flask routes on synthetic archives of 10, 1k, 10k and 100k posts: latency and throughput of
+# get_all_posts (first, middle and last page, cursor), show_post (page cache hit, miss and 404) and edit_post GET,
+# plus JSON parse time, startup from backup.json and memory. Every archive size runs in a fresh process.
+# Results are written as JSON, compare two runs with benchmarks/compare.py.
+# Usage: python benchmarks/routes.py [--sizes 10 1000 10000 100000] [--requests 200] [--out results.json]
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from synthetic import generate_posts  # noqa: E402
+
+
+def rss_mib() -> float:
+    with open("/proc/self/status") as file:
+        for line in file:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def summarize(timings: list) -> dict:
+    timings = sorted(timings)
+    return {
+        "requests/s": round(len(timings) / sum(timings), 1),
+        "p50 ms": round(statistics.median(timings) * 1000, 3),
+        "p99 ms": round(timings[min(len(timings) - 1, int(len(timings) * 0.99))] * 1000, 3),
+    }
+
+
+def time_requests(client, urls: list, count: int, before=None) -> dict:
+    timings = []
+    for i in range(count):
+        url = urls[i % len(urls)]
+        if before is not None:
+            before()
+        start = time.perf_counter()
+        response = client.get(url)
+        timings.append(time.perf_counter() - start)
+        assert response.status_code in (200, 404), f"{url}: {response.status_code}"
+    return summarize(timings)
+
+
+# Runs in the per-size process, with the synthetic archive as static/assets/backup.json under the working directory
+def measure(requests: int) -> dict:
+    result = {}
+    with open("static/assets/backup.json", "rb") as file:
+        payload = file.read()
+    parse_times = []
+    for _ in range(3):
+        start = time.perf_counter()
+        json.loads(payload)
+        parse_times.append(time.perf_counter() - start)
+    result["json"] = {"bytes": len(payload), "parse ms": round(min(parse_times) * 1000, 2)}
+    del payload
+
+    from snapshot import release_memory
+    release_memory()
+    rss_before = rss_mib()
+    start = time.perf_counter()
+    import main
+    result["startup"] = {
+        "import main ms": round((time.perf_counter() - start) * 1000, 1),
+        "rss MiB": round(rss_mib(), 1),
+        "rss of the app MiB": round(rss_mib() - rss_before, 1),
+    }
+    client = main.app.test_client()
+    posts = main.post_store.posts
+    total_pages = main.paginator.total_pages
+    slugs = [f"/{post.slug}" for post in posts[::max(1, len(posts) // 200)]]
+    cursor = posts[len(posts) // 2].id
+    for url in ["/", f"/?page={total_pages}"] + slugs[:1]:
+        client.get(url)
+
+    routes = {
+        "get_all_posts first page": time_requests(client, ["/"], requests),
+        "get_all_posts middle page": time_requests(client, [f"/?page={max(1, total_pages // 2)}"], requests),
+        "get_all_posts last page": time_requests(client, [f"/?page={total_pages}"], requests),
+        "get_all_posts cursor": time_requests(client, [f"/?after={cursor}"], requests),
+        "show_post hit": time_requests(client, slugs[:1], requests),
+        "show_post miss": time_requests(client, slugs, requests, before=main.page_cache.clear),
+        "show_post 404": time_requests(client, ["/no-such-post"], requests),
+        "edit_post GET": time_requests(client, [f"/edit-post/{post.id}" for post in posts[:50]], requests),
+    }
+    result["routes"] = routes
+    result["rss after requests MiB"] = round(rss_mib(), 1)
+
+    # Loading the snapshot on its own, without the imports and app setup around it
+    start = time.perf_counter()
+    main.PostStore(main.load_startup_posts())
+    result["startup"]["load snapshot ms"] = round((time.perf_counter() - start) * 1000, 1)
+    return result
+
+
+def run_size(size: int, requests: int, paragraphs: int) -> dict:
+    workdir = tempfile.mkdtemp()
+    try:
+        os.makedirs(os.path.join(workdir, "static", "assets"))
+        with open(os.path.join(workdir, "static", "assets", "backup.json"), "w") as file:
+            json.dump(generate_posts(size, paragraphs), file)
+        # An empty snapshot cache, so startup loads backup.json like a first deploy, and no network
+        env = dict(os.environ, SNAPSHOT_CACHE_DIR=os.path.join(workdir, "cache"), NPOINT_REFRESH_INTERVAL="-1",
+                   SECRET_KEY="benchmark", JOURNAL_PATH=os.path.join(workdir, "journal.jsonl"),
+                   PYTHONPATH=os.pathsep.join([ROOT, os.path.dirname(os.path.abspath(__file__))]))
+        output = subprocess.run([sys.executable, os.path.abspath(__file__), "--measure", "--requests", str(requests)],
+                                cwd=workdir, env=env, check=True, capture_output=True, text=True).stdout
+        return json.loads(output.strip().splitlines()[-1])
+    finally:
+        shutil.rmtree(workdir)
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "describe", "--always", "--dirty"], cwd=ROOT, check=True,
+                              capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def run():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 1000, 10000, 100000])
+    parser.add_argument("--requests", type=int, default=200, help="requests per route")
+    parser.add_argument("--paragraphs", type=int, default=12, help="paragraphs per synthetic post body")
+    parser.add_argument("--out", help="defaults to benchmarks/results/<commit>.json")
+    parser.add_argument("--measure", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure:
+        print(json.dumps(measure(args.requests)))
+        return
+
+    commit = git_commit()
+    report = {
+        "commit": commit,
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "machine": f"{platform.machine()}, {os.cpu_count()} cpu",
+        "requests per route": args.requests,
+        "paragraphs": args.paragraphs,
+        "sizes": {},
+    }
+    for size in args.sizes:
+        print(f"{size} posts ...", file=sys.stderr)
+        report["sizes"][str(size)] = run_size(size, args.requests, args.paragraphs)
+
+    out = args.out or os.path.join(ROOT, "benchmarks", "results", f"{commit}.json")
+    os.makedirs(os.path.dirname(out), exist_ok=True)
+    with open(out, "w") as file:
+        json.dump(report, file, indent=2)
+    print(out)
+
+
+if __name__ == "__main__":
+    run()
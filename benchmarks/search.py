@@ -0,0 +1,64 @@
+# Measures index build time, memory and query latency of the /search index on synthetic archives.
+# Usage: python benchmarks/search.py [--sizes 1000 10000 50000]
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from search import SearchIndex  # noqa: E402
+from store import PostStore  # noqa: E402
+from synthetic import generate_posts  # noqa: E402
+from routes import rss_mib  # noqa: E402
+
+QUERIES = ["bitcoin", "betting odds", "lego brick history", "strat", "python pandas notebook", "risk rew"]
+
+
+def run():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 50000])
+    parser.add_argument("--rounds", type=int, default=20)
+    args = parser.parse_args()
+
+    for size in args.sizes:
+        # Bodies memory-mapped like in the app, so the index is what the rss grows by
+        store = PostStore(generate_posts(size), body_dir=tempfile.mkdtemp())
+        index = SearchIndex(store)
+
+        rss_before = rss_mib()
+        start = time.perf_counter()
+        index.sync()
+        build = time.perf_counter() - start
+        memory = rss_mib() - rss_before
+        postings = sum(index._segment.frequencies)
+
+        cold = []
+        for query in QUERIES:
+            start = time.perf_counter()
+            index.search(query)
+            cold.append(time.perf_counter() - start)
+
+        timings = []
+        for _ in range(args.rounds):
+            for query in QUERIES:
+                start = time.perf_counter()
+                index.search(query)
+                timings.append(time.perf_counter() - start)
+
+        post = store.posts[size // 2]
+        store.update(post, body=post.body + "<p>zebra</p>")
+        start = time.perf_counter()
+        index.sync()
+        reindex = time.perf_counter() - start
+
+        print(f"{size:>7} posts: build {build:7.2f} s, {memory:6.1f} MiB for {postings:,} postings, first query max {max(cold) * 1000:7.2f} ms, query median {statistics.median(timings) * 1000:7.2f} ms, "
+              f"p99 {statistics.quantiles(timings, n=100)[98] * 1000:7.2f} ms, "
+              f"re-index after one edit {reindex * 1000:7.2f} ms")
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,46 @@
+# Synthetic blog data with the shape of static/schema.json, for benchmarks at sizes the real bin doesn't reach
+import itertools
+import random
+from datetime import date, timedelta
+
+BASE_WORDS = (
+    "market strategy bitcoin signal trade profit loss model data season goal betting odds simulation "
+    "life ethics death emotion lego brick brand toy history analysis result chart parameter risk reward "
+    "backtest entry target exit volume price trend average weekly monthly yearly growth idea thought "
+    "conclusion question answer experiment method python pandas notebook code study pattern outcome"
+).split()
+SYLLABLES = ("ka", "lo", "mi", "ne", "ru", "sa", "ti", "vo", "ze", "pa", "qu", "dre", "bor", "lin", "tas")
+
+
+# A vocabulary with natural text's long tail: a few words are everywhere, most are rare (Zipf-like weights)
+def vocabulary(rng: random.Random, size: int = 20000):
+    words = list(BASE_WORDS)
+    while len(words) < size:
+        words.append("".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))))
+    weights = [1 / rank for rank in range(1, len(words) + 1)]
+    return words, weights
+
+
+def sentence(rng: random.Random, length: int, vocab) -> str:
+    return " ".join(rng.choices(vocab[0], cum_weights=vocab[1], k=length)).capitalize()
+
+
+# `count` posts, newest first like the n:point bin, each body roughly `paragraphs` paragraphs of html
+def generate_posts(count: int, paragraphs: int = 12, seed: int = 42) -> list:
+    rng = random.Random(seed)
+    words, weights = vocabulary(rng)
+    vocab = (words, list(itertools.accumulate(weights)))
+    first_day = date(2024, 1, 1)
+    posts = []
+    for post_id in range(count, 0, -1):
+        body = "\r\n\r\n".join(f"<p>{sentence(rng, rng.randint(40, 90), vocab)}.</p>" for _ in range(paragraphs))
+        posts.append({
+            "id": post_id,
+            "title": f"{sentence(rng, rng.randint(3, 7), vocab)} {post_id}",
+            "subtitle": sentence(rng, rng.randint(5, 10), vocab),
+            "date": (first_day + timedelta(days=post_id)).strftime("%B %d, %Y"),
+            "author": "John Doe",
+            "image_url": f"/static/uploads/{post_id % 28 + 1}.png",
+            "body": body,
+        })
+    return posts
@@ -0,0 +1,89 @@
+# Measures total memory of gunicorn (master + workers) with 1, 4 and 16 workers on a synthetic archive,
+# with the shared snapshot from gunicorn.conf.py and with every worker loading its own copy. Linux only (reads /proc).
+# Usage: python benchmarks/worker_rss.py [--posts 5000] [--workers 1 4 16]
+import argparse
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from snapshot import compact, save_cached  # noqa: E402
+from synthetic import generate_posts  # noqa: E402
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def children(pid: int) -> list:
+    with open(f"/proc/{pid}/task/{pid}/children") as file:
+        return [int(child) for child in file.read().split()]
+
+
+# (rss, pss) in KiB of a process
+def memory(pid: int) -> tuple:
+    values = {}
+    with open(f"/proc/{pid}/smaps_rollup") as file:
+        for line in file:
+            name, _, rest = line.partition(":")
+            if name in ("Rss", "Pss"):
+                values[name] = int(rest.split()[0])
+    return values["Rss"], values["Pss"]
+
+
+def measure(mode: str, workers: int, cache_dir: str, requests: int) -> tuple:
+    port = free_port()
+    env = dict(os.environ, SNAPSHOT_CACHE_DIR=cache_dir, NPOINT_REFRESH_INTERVAL="-1", SECRET_KEY="benchmark",
+               JOURNAL_PATH=os.path.join(cache_dir, "journal.jsonl"))
+    config = os.path.join(ROOT, "gunicorn.conf.py") if mode == "shared" else os.devnull
+    server = subprocess.Popen([sys.executable, "-m", "gunicorn", "-c", config, "-w", str(workers),
+                               "-b", f"127.0.0.1:{port}", "main:app"],
+                              cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        for _ in range(600):
+            try:
+                urllib.request.urlopen(f"http://127.0.0.1:{port}/", timeout=5).read()
+                break
+            except OSError:
+                time.sleep(0.1)
+        # Let every worker serve some post pages so their caches are warm
+        for i in range(requests):
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/?page={i % 50 + 1}", timeout=30).read()
+        time.sleep(1)
+        pids = [server.pid] + children(server.pid)
+        usage = [memory(pid) for pid in pids]
+        return sum(rss for rss, _ in usage), sum(pss for _, pss in usage)
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def run():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--posts", type=int, default=5000)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--requests", type=int, default=200)
+    args = parser.parse_args()
+
+    cache_dir = tempfile.mkdtemp()
+    try:
+        save_cached(compact(generate_posts(args.posts)), os.path.join(cache_dir, "snapshot.json"))
+        for workers in args.workers:
+            for mode in ("per-worker", "shared"):
+                rss, pss = measure(mode, workers, cache_dir, args.requests)
+                print(f"{workers:>3} workers, {mode:>10}: RSS {rss / 1024:8.1f} MiB, PSS {pss / 1024:8.1f} MiB")
+    finally:
+        shutil.rmtree(cache_dir)
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,150 @@
+# Prerenders the blog to static files: the index, every older-posts page and every post page.
+# Usage: python export.py [--out build] [--workers 4] [--fetch]
+import argparse
+import hashlib
+import json
+import os
+import re
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import quote
+
+# The export works on the startup snapshot unless --fetch is given, so workers never go to n:point
+os.environ["NPOINT_REFRESH_INTERVAL"] = "-1"
+
+import main  # noqa: E402
+
+# The render workers generate the variants their pages reference themselves, see export_variants
+main.image_pipeline.background = False
+
+MANIFEST = ".export-manifest.json"
+HASHED_ASSETS = ("css/styles.css", "js/scripts.js")
+TEMPLATES = ("layout.html", "index.html", "post.html")
+CURSOR_LINK = re.compile(r'href="/\?after=(-?\d+)"')
+VARIANT_LINK = re.compile(r'/img/(\w+)/(\d+)/([\w.-]+)')
+
+
+def file_hash(path: str) -> str:
+    with open(path, "rb") as file:
+        return hashlib.sha256(file.read()).hexdigest()[:12]
+
+
+# Copy static/ and give the theme css and js content-hashed names so they can be cached forever
+def export_static(out: str) -> dict:
+    shutil.copytree(main.app.static_folder, os.path.join(out, "static"), dirs_exist_ok=True)
+    assets = {}
+    for asset in HASHED_ASSETS:
+        name, extension = os.path.splitext(asset)
+        hashed = f"{name}.{file_hash(os.path.join(main.app.static_folder, asset))}{extension}"
+        shutil.copyfile(os.path.join(main.app.static_folder, asset), os.path.join(out, "static", hashed))
+        assets[f"/static/{asset}"] = f"/static/{hashed}"
+    return assets
+
+
+# Copy the responsive image variants a page references into img/, generating the ones not cached yet.
+# Runs in the render workers, so only the variants of re-rendered pages are touched, in parallel.
+def export_variants(html: str, out: str):
+    for source_hash, width, name in set(VARIANT_LINK.findall(html)):
+        target = os.path.join(out, "img", source_hash, width, name)
+        if os.path.exists(target):
+            continue
+        filename, _, fmt = name.rpartition(".")
+        path = main.image_pipeline.variant_path(filename, source_hash, int(width), fmt)
+        if path is None:
+            raise RuntimeError(f"{name} has no {width}px variant")
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        # Pages in other workers can reference the same image
+        tmp_path = f"{target}.{os.getpid()}.tmp"
+        shutil.copyfile(path, tmp_path)
+        os.replace(tmp_path, target)
+
+
+# Every page of the site as (url, output file, hash of everything it is rendered from)
+def pages(assets: dict) -> list:
+    base = hashlib.sha256(json.dumps(assets, sort_keys=True).encode())
+    for template in TEMPLATES:
+        base.update(file_hash(os.path.join(main.app.template_folder, template)).encode())
+
+    def source_hash(*parts) -> str:
+        digest = base.copy()
+        digest.update(json.dumps(parts, sort_keys=True, default=str).encode())
+        return digest.hexdigest()
+
+    result = []
+    page = main.paginator.page(1)
+    url, path = "/", "index.html"
+    while page is not None:
+        result.append((url, path, source_hash(page.posts, page.next_cursor)))
+        if not page.has_next:
+            break
+        url, path = f"/?after={page.next_cursor}", f"after/{page.next_cursor}/index.html"
+        page = main.paginator.after(page.next_cursor)
+
+    for post in main.post_store.posts:
+        result.append((f"/{quote(post.slug)}", f"{post.slug}/index.html", source_hash(post.to_dict())))
+    return result
+
+
+# Runs in the pool workers: render a batch of pages with the Flask app and write them to disk
+def render(batch: list, out: str, assets: dict):
+    client = main.app.test_client()
+    for url, path in batch:
+        response = client.get(url)
+        if response.status_code != 200:
+            raise RuntimeError(f"{url} returned {response.status_code}")
+        html = response.get_data(as_text=True)
+        export_variants(html, out)
+        for original, hashed in assets.items():
+            html = html.replace(original, hashed)
+        html = CURSOR_LINK.sub(r'href="/after/\1/"', html)
+        target = os.path.join(out, path)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        with open(target, "w", encoding="utf-8") as file:
+            file.write(html)
+    return len(batch)
+
+
+def export(out: str, workers: int = None, batch_size: int = 50) -> dict:
+    start = time.perf_counter()
+    os.makedirs(out, exist_ok=True)
+    manifest_path = os.path.join(out, MANIFEST)
+    try:
+        with open(manifest_path) as file:
+            previous = json.load(file)
+    except (OSError, ValueError):
+        previous = {}
+
+    assets = export_static(out)
+    current = {path: (url, digest) for url, path, digest in pages(assets)}
+
+    # Only pages whose sources changed since the last build (or that went missing) are rendered again
+    stale = [(url, path) for path, (url, digest) in current.items()
+             if previous.get(path) != digest or not os.path.exists(os.path.join(out, path))]
+    # Small sites still spread over every worker, the pages with images are what takes time
+    size = max(1, min(batch_size, -(-len(stale) // (workers or os.cpu_count() or 1))))
+    batches = [stale[i:i + size] for i in range(0, len(stale), size)]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        rendered = sum(pool.map(render, batches, [out] * len(batches), [assets] * len(batches)))
+
+    for path in previous.keys() - current.keys():
+        try:
+            os.remove(os.path.join(out, path))
+        except FileNotFoundError:
+            pass
+
+    with open(manifest_path, "w") as file:
+        json.dump({path: digest for path, (_, digest) in current.items()}, file)
+    return {"pages": len(current), "rendered": rendered, "seconds": round(time.perf_counter() - start, 2)}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Prerender the blog to static files.")
+    parser.add_argument("--out", default="build")
+    parser.add_argument("--workers", type=int, default=None, help="render processes, defaults to the cpu count")
+    parser.add_argument("--fetch", action="store_true", help="fetch the latest n:point snapshot first")
+    args = parser.parse_args()
+
+    if args.fetch:
+        main.refresher.refresh_with_retry()
+    print(export(args.out, args.workers))
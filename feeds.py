@@ -0,0 +1,157 @@
+# /sitemap.xml and /feed.xml (RSS 2.0), built from the posts of a PostStore.
+# Every post's xml fragment is cached with the fields it was built from, so a new dataset version only rebuilds
+# the fragments of posts that changed. Documents are streamed from the fragments in chunks, and their ETag is
+# derived from the fragment contents, so it's the same in every worker.
+import hashlib
+import threading
+from datetime import datetime, timezone
+from email.utils import format_datetime
+from urllib.parse import quote
+from xml.sax.saxutils import escape
+
+TITLE = "Brain Snippets"
+DESCRIPTION = "Ideas, Thoughts and Conclusions I'd like to share with you."
+FEED_SIZE = 50
+# Sitemaps are limited to 50,000 urls each, larger archives get a sitemap index
+SITEMAP_SIZE = 50000
+CHUNK_SIZE = 64 * 1024
+# Documents kept per dataset version. Every root (Host header) gets its own, so without SITE_URL this bounds them.
+MAX_DOCUMENTS = 64
+
+
+# Date of a post ("December 9, 2024") as an aware datetime, None if it isn't in that format
+def post_date(text: str):
+    try:
+        return datetime.strptime(text, "%B %d, %Y").replace(tzinfo=timezone.utc)
+    except ValueError:
+        return None
+
+
+class Document:
+    __slots__ = ("parts", "etag")
+
+    def __init__(self, parts: list, digests: list):
+        self.parts = parts
+        self.etag = hashlib.sha256("".join(digests).encode()).hexdigest()[:32]
+
+    # The document in chunks of about CHUNK_SIZE characters
+    def stream(self):
+        chunk, size = [], 0
+        for part in self.parts:
+            chunk.append(part)
+            size += len(part)
+            if size >= CHUNK_SIZE:
+                yield "".join(chunk).encode()
+                chunk, size = [], 0
+        if chunk:
+            yield "".join(chunk).encode()
+
+
+class Feeds:
+    def __init__(self, store, feed_size: int = FEED_SIZE, sitemap_size: int = SITEMAP_SIZE,
+                 max_documents: int = MAX_DOCUMENTS):
+        self.store = store
+        self.feed_size = feed_size
+        self.sitemap_size = sitemap_size
+        self.max_documents = max_documents
+        # {(kind, slug): (inputs, fragment, digest)}, kept across versions
+        self._fragments = {}
+        self._documents = {}
+        self._version = None
+        # Reentrant, the sitemap index is built from the sitemaps
+        self._lock = threading.RLock()
+
+    # root is the absolute url of the site, e.g. request.url_root. None if there is no such sitemap.
+    def sitemap(self, root: str, number: int = None):
+        posts = self.store.posts
+        sitemaps = max(1, -(-len(posts) // self.sitemap_size))
+        if number is None and sitemaps > 1:
+            return self._document(("index", root), lambda: self._sitemap_index(root, sitemaps))
+        if number is None:
+            number = 1
+        if not 1 <= number <= sitemaps:
+            return None
+        return self._document(("sitemap", root, number), lambda: self._sitemap(root, number))
+
+    def feed(self, root: str):
+        return self._document(("feed", root), lambda: self._feed(root))
+
+    def _document(self, key, build) -> Document:
+        with self._lock:
+            if self._version != self.store.version:
+                self._documents.clear()
+                self._version = self.store.version
+            document = self._documents.get(key)
+            if document is None:
+                document = build()
+                if len(self._documents) >= self.max_documents:
+                    del self._documents[next(iter(self._documents))]
+                self._documents[key] = document
+            return document
+
+    def _fragment(self, kind: str, post, inputs: tuple, build):
+        key = (kind, post.slug)
+        cached = self._fragments.get(key)
+        if cached is None or cached[0] != inputs:
+            fragment = build()
+            cached = self._fragments[key] = (inputs, fragment, hashlib.sha1(fragment.encode()).hexdigest())
+        return cached
+
+    def _prune(self, kind: str, slugs: set):
+        for key in [key for key in self._fragments if key[0] == kind and key[1] not in slugs]:
+            del self._fragments[key]
+
+    def _sitemap(self, root: str, number: int) -> Document:
+        posts = self.store.posts
+        head = '<?xml version="1.0" encoding="UTF-8"?>\n<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n'
+        parts, digests = [head], [head]
+        if number == 1:
+            parts.append(f"<url><loc>{escape(root)}</loc></url>\n")
+            digests.append(parts[-1])
+        chosen = posts[(number - 1) * self.sitemap_size:number * self.sitemap_size]
+        for post in chosen:
+            inputs = (root, post.date)
+            _, fragment, digest = self._fragment("sitemap", post, inputs, lambda post=post: self._url(root, post))
+            parts.append(fragment)
+            digests.append(digest)
+        parts.append("</urlset>\n")
+        self._prune("sitemap", {post.slug for post in posts})
+        return Document(parts, digests)
+
+    def _sitemap_index(self, root: str, sitemaps: int) -> Document:
+        parts = ['<?xml version="1.0" encoding="UTF-8"?>\n'
+                 '<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n']
+        for number in range(1, sitemaps + 1):
+            parts.append(f"<sitemap><loc>{escape(root)}sitemap-{number}.xml</loc></sitemap>\n")
+        parts.append("</sitemapindex>\n")
+        # Changes with the contents of the sitemaps it points to
+        return Document(parts, [self.sitemap(root, number).etag for number in range(1, sitemaps + 1)])
+
+    def _url(self, root: str, post) -> str:
+        date = post_date(post.date)
+        lastmod = f"<lastmod>{date.strftime('%Y-%m-%d')}</lastmod>" if date else ""
+        return f"<url><loc>{escape(root + quote(post.slug))}</loc>{lastmod}</url>\n"
+
+    def _feed(self, root: str) -> Document:
+        posts = self.store.posts[:self.feed_size]
+        head = ('<?xml version="1.0" encoding="UTF-8"?>\n'
+                '<rss version="2.0" xmlns:dc="http://purl.org/dc/elements/1.1/">\n<channel>\n'
+                f"<title>{escape(TITLE)}</title>\n<link>{escape(root)}</link>\n"
+                f"<description>{escape(DESCRIPTION)}</description>\n")
+        parts, digests = [head], [head]
+        for post in posts:
+            inputs = (root, post.title, post.subtitle, post.author, post.date)
+            _, fragment, digest = self._fragment("feed", post, inputs, lambda post=post: self._item(root, post))
+            parts.append(fragment)
+            digests.append(digest)
+        parts.append("</channel>\n</rss>\n")
+        self._prune("feed", {post.slug for post in posts})
+        return Document(parts, digests)
+
+    def _item(self, root: str, post) -> str:
+        link = escape(root + quote(post.slug))
+        date = post_date(post.date)
+        published = f"<pubDate>{format_datetime(date)}</pubDate>" if date else ""
+        return (f"<item><title>{escape(post.title)}</title><link>{link}</link>"
+                f'<guid isPermaLink="true">{link}</guid><description>{escape(post.subtitle)}</description>'
+                f"<dc:creator>{escape(post.author)}</dc:creator>{published}</item>\n")
@@ -1,5 +1,6 @@
 from flask_wtf import FlaskForm
-from wtforms import StringField, SubmitField
+from wtforms import StringField, SubmitField, IntegerField
+from wtforms.widgets import HiddenInput
 from wtforms.validators import DataRequired, URL
 from flask_ckeditor import CKEditorField
 
@@ -9,6 +10,8 @@ class CreatePostForm(FlaskForm):
     subtitle = StringField("Subtitle", validators=[DataRequired()])
     img_url = StringField("Blog Image URL", validators=[DataRequired()])
     author = StringField("Author", validators=[DataRequired()])
-    body = CKEditorField("Blog Content (Make sure to copy your draft somewhere first)", validators=[DataRequired()])
+    body = CKEditorField("Blog Content", validators=[DataRequired()])
+    # Revision of the post the form was loaded with, to detect concurrent edits
+    revision = IntegerField(widget=HiddenInput(), default=0)
     submit = SubmitField("Submit Post")
 
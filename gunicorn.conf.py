@@ -0,0 +1,20 @@
+# Loads the app, and with it the post snapshot, once in the master process. Forked workers share those pages
+# copy-on-write instead of each downloading and parsing the bin, and post bodies are memory-mapped from one file.
+import gc
+import os
+import sys
+
+os.environ.setdefault("SNAPSHOT_SHARED", "1")
+
+preload_app = True
+workers = int(os.getenv("WEB_CONCURRENCY", 2))
+
+
+def when_ready(server):
+    # Keep the garbage collector from touching (and thereby copying) the preloaded objects in every worker
+    gc.collect()
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    sys.modules["main"].watcher.start()
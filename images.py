@@ -0,0 +1,245 @@
+# Responsive variants of the images in static/uploads.
+# Post bodies embed the full-size PNGs; at render time their <img> tags are rewritten to a <picture> with
+# WebP (and AVIF, if Pillow supports it) variants at several widths, explicit dimensions and lazy loading.
+# Missing variants are generated by a background thread as soon as a page referencing them is rendered.
+# Usage: python images.py build   (pregenerate every variant)
+#        python images.py report  (bytes saved per post page)
+import argparse
+import hashlib
+import html
+import logging
+import os
+import queue
+import re
+import threading
+from contextlib import contextmanager
+
+WIDTHS = (480, 960, 1440)
+QUALITY = {"webp": 80, "avif": 60}
+IMG_TAG = re.compile(r"<img\b[^>]*>", re.IGNORECASE)
+ATTRIBUTE = re.compile(r'([\w-]+)\s*=\s*"([^"]*)"')
+UPLOAD_SRC = re.compile(r"^(?:https?://[^/]+)?/static/uploads/([\w.-]+\.(?:png|jpe?g))$", re.IGNORECASE)
+
+logger = logging.getLogger(__name__)
+
+
+# PIL.Image, None if Pillow isn't installed. Imported on first use, booting the app doesn't need it.
+def pillow():
+    try:
+        from PIL import Image
+    except ImportError:
+        return None
+    return Image
+
+
+# Variant formats this Pillow build can write, best compression first
+def formats() -> tuple:
+    Image = pillow()
+    if Image is None:
+        return ()
+    Image.init()
+    return tuple(fmt for fmt in ("avif", "webp") if fmt.upper() in Image.SAVE)
+
+
+class ImagePipeline:
+    def __init__(self, upload_dir: str, cache_dir: str, widths: tuple = WIDTHS,
+                 sizes: str = "(min-width: 768px) 80vw, 100vw"):
+        self.upload_dir = upload_dir
+        self.cache_dir = cache_dir
+        self.widths = widths
+        self.sizes = sizes
+        self._formats = None
+        self._info = {}
+        # Set to False to only generate variants on the calling thread (the static export does)
+        self.background = True
+        # Variant path -> [lock, threads holding or waiting for it]; encodes of different variants run in parallel
+        self._locks = {}
+        self._lock = threading.Lock()
+        self._queue = None
+        self._queued = set()
+        self._pid = None
+
+    @property
+    def formats(self) -> tuple:
+        if self._formats is None:
+            self._formats = formats()
+        return self._formats
+
+    # (width, height, source hash) of an upload, None if it doesn't exist or can't be read.
+    # Only regular files directly in upload_dir count, names like ".." come straight from variant urls.
+    def info(self, filename: str):
+        if os.path.basename(filename) != filename:
+            return None
+        path = os.path.join(self.upload_dir, filename)
+        if not os.path.isfile(path):
+            return None
+        try:
+            mtime = os.stat(path).st_mtime
+            cached = self._info.get(filename)
+            if cached is not None and cached[0] == mtime:
+                return cached[1]
+            with open(path, "rb") as file:
+                source_hash = hashlib.sha256(file.read()).hexdigest()[:16]
+        except OSError:
+            return None
+        try:
+            with pillow().open(path) as image:
+                info = (image.width, image.height, source_hash)
+        except Exception:
+            info = None
+        self._info[filename] = (mtime, info)
+        return info
+
+    def variant_widths(self, width: int) -> list:
+        return [candidate for candidate in self.widths if candidate < width] + [width]
+
+    def variant_name(self, filename: str, source_hash: str, width: int, fmt: str) -> str:
+        return f"{source_hash}/{width}/{filename}.{fmt}"
+
+    # Where a variant is (or will be) cached, None if the upload has no such variant. Variants are keyed by the
+    # source hash, so a replaced upload never serves stale variants.
+    def variant_file(self, filename: str, source_hash: str, width: int, fmt: str):
+        info = self.info(filename)
+        if info is None or info[2] != source_hash or fmt not in self.formats or width not in self.variant_widths(info[0]):
+            return None
+        return os.path.join(self.cache_dir, self.variant_name(filename, source_hash, width, fmt))
+
+    # Path of a variant on disk, generated on the calling thread if it's missing
+    def variant_path(self, filename: str, source_hash: str, width: int, fmt: str):
+        path = self.variant_file(filename, source_hash, width, fmt)
+        if path is None or os.path.exists(path):
+            return path
+        with self._path_lock(path):
+            if not os.path.exists(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                Image = pillow()
+                with Image.open(os.path.join(self.upload_dir, filename)) as image:
+                    height = round(image.height * width / image.width)
+                    resized = image if width == image.width else image.resize((width, height), Image.LANCZOS)
+                    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+                    resized.save(tmp_path, fmt.upper(), quality=QUALITY[fmt])
+                    os.replace(tmp_path, path)
+        return path
+
+    @contextmanager
+    def _path_lock(self, path: str):
+        with self._lock:
+            entry = self._locks.setdefault(path, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._lock:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self._locks[path]
+
+    # Queue the missing variants of an upload for the background thread
+    def schedule(self, filename: str):
+        with self._lock:
+            # A thread started before a fork (gunicorn preload) doesn't exist in the worker, each process starts its own
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._queue, self._queued = queue.SimpleQueue(), set()
+                threading.Thread(target=self._run, args=(self._queue,), name="image-variants", daemon=True).start()
+            if filename in self._queued:
+                return
+            self._queued.add(filename)
+            self._queue.put(filename)
+
+    def _run(self, filenames: queue.SimpleQueue):
+        while True:
+            filename = filenames.get()
+            try:
+                info = self.info(filename)
+                if info is not None:
+                    for width in self.variant_widths(info[0]):
+                        for fmt in self.formats:
+                            self.variant_path(filename, info[2], width, fmt)
+            except Exception:
+                logger.exception("Generating the variants of %s failed", filename)
+            finally:
+                with self._lock:
+                    self._queued.discard(filename)
+
+    # Every variant of every upload as (variant name, path), generating missing ones
+    def all_variants(self):
+        for filename in sorted(os.listdir(self.upload_dir)):
+            info = self.info(filename)
+            if info is None:
+                continue
+            for width in self.variant_widths(info[0]):
+                for fmt in self.formats:
+                    yield self.variant_name(filename, info[2], width, fmt), self.variant_path(filename, info[2], width, fmt)
+
+    # Rewrite every <img> pointing at an upload; leaves the html untouched if Pillow isn't installed.
+    # url_for_variant(source_hash, width, name) returns the url of a variant.
+    def rewrite(self, body: str, url_for_variant) -> str:
+        if not self.formats:
+            return body
+        return IMG_TAG.sub(lambda match: self._picture(match.group(0), url_for_variant), body)
+
+    def _picture(self, tag: str, url_for_variant) -> str:
+        attributes = dict(ATTRIBUTE.findall(tag))
+        source = UPLOAD_SRC.match(html.unescape(attributes.get("src", "")))
+        info = self.info(source.group(1)) if source else None
+        if info is None:
+            return tag
+        filename = source.group(1)
+        width, height, source_hash = info
+        if self.background and not all(os.path.exists(self.variant_file(filename, source_hash, variant_width, fmt))
+                                       for variant_width in self.variant_widths(width) for fmt in self.formats):
+            self.schedule(filename)
+
+        sources = []
+        for fmt in self.formats:
+            srcset = ", ".join(f"{url_for_variant(source_hash, variant_width, f'{filename}.{fmt}')} {variant_width}w"
+                               for variant_width in self.variant_widths(width))
+            sources.append(f'<source type="image/{fmt}" srcset="{html.escape(srcset)}" sizes="{self.sizes}" />')
+
+        attributes.update(width=str(width), height=str(height), loading="lazy", decoding="async")
+        img = "<img " + " ".join(f'{name}="{value}"' for name, value in attributes.items()) + " />"
+        return "<picture>" + "".join(sources) + img + "</picture>"
+
+    # Bytes of the original uploads a page embeds vs. the variant a ~960px wide viewport would pick
+    def page_savings(self, body: str) -> tuple:
+        original = optimized = 0
+        for tag in IMG_TAG.findall(body):
+            source = UPLOAD_SRC.match(html.unescape(dict(ATTRIBUTE.findall(tag)).get("src", "")))
+            info = self.info(source.group(1)) if source else None
+            if info is None:
+                continue
+            filename, (width, _, source_hash) = source.group(1), info
+            original += os.path.getsize(os.path.join(self.upload_dir, filename))
+            chosen = next(candidate for candidate in self.variant_widths(width) if candidate >= min(960, width))
+            optimized += min(os.path.getsize(self.variant_path(filename, source_hash, chosen, fmt))
+                             for fmt in self.formats)
+        return original, optimized
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate and report on responsive image variants.")
+    parser.add_argument("command", choices=("build", "report"))
+    args = parser.parse_args()
+
+    os.environ["NPOINT_REFRESH_INTERVAL"] = "-1"
+    import main
+
+    pipeline = main.image_pipeline
+    if not pipeline.formats:
+        raise SystemExit("Pillow with WebP support is required: pip install Pillow")
+
+    if args.command == "build":
+        count = sum(1 for _ in pipeline.all_variants())
+        print(f"{count} variants in {pipeline.cache_dir}")
+    else:
+        total_original = total_optimized = 0
+        for post in main.post_store.posts:
+            original, optimized = pipeline.page_savings(post.body)
+            if original:
+                print(f"{post.slug}: {original / 1024:8.0f} KiB -> {optimized / 1024:6.0f} KiB "
+                      f"({(1 - optimized / original) * 100:4.1f}% saved)")
+            total_original += original
+            total_optimized += optimized
+        print(f"total: {total_original / 1024:.0f} KiB -> {total_optimized / 1024:.0f} KiB")
@@ -1,105 +1,283 @@
-from datetime import date
-from flask import Flask, render_template, redirect, url_for, flash, request
+from flask import Flask, render_template, url_for, request, abort, make_response, session, send_file, g, redirect
 from flask_bootstrap import Bootstrap5
-from flask_ckeditor import CKEditor
-from forms import CreatePostForm
+import math
 import os
-import requests
-import json
-import pyperclip
+import time
 import dotenv
+import metrics
+from store import PostStore
+from snapshot import SnapshotRefresher, SnapshotWatcher, load_startup_posts, release_memory, CACHE_DIR
+from page_cache import MissCache, PageCache
+from pagination import Paginator
+from search import SearchIndex
+from images import ImagePipeline
+from storage import Journal, NpointBackend, Publisher, PostWriter
+from admin import admin_blueprint
+from feeds import Feeds
+from ratelimit import MemoryBackend, RateLimiter
 
 dotenv.load_dotenv()
 
 app = Flask(__name__)
 app.secret_key = os.getenv("SECRET_KEY")
 
-ckeditor = CKEditor(app)
 Bootstrap5(app)
 
-try:
-    blog_data = requests.get(f"https://api.npoint.io/{os.getenv("NPOINT")}").json()
-except Exception:
-    with open("static/assets/backup.json", "r") as file:
-        blog_data = json.load(file)
+npoint_url = os.getenv("NPOINT_URL", f"https://api.npoint.io/{os.getenv('NPOINT')}")
+
+# Posts written through the app are journaled locally and stay on top of every snapshot until n:point has them
+journal = Journal(os.getenv("JOURNAL_PATH", "data/journal.jsonl"))
+
+# Serve the last good snapshot right away and reconcile with n:point in the background
+post_store = PostStore(journal.overlay(load_startup_posts()), body_dir=CACHE_DIR,
+                       body_cache_size=int(os.getenv("BODY_CACHE_SIZE", 128)))
+release_memory()
+refresher = SnapshotRefresher(
+    npoint_url,
+    post_store,
+    interval=float(os.getenv("NPOINT_REFRESH_INTERVAL", 300)),
+    overlay=journal.overlay,
+)
+
+publisher = None
+if os.getenv("NPOINT_PUSH") == "1":
+    publisher = Publisher(NpointBackend(npoint_url), journal, post_store, delay=float(os.getenv("NPOINT_PUSH_DELAY", 5)))
+post_writer = PostWriter(post_store, journal, publisher)
+
+# Under gunicorn (see gunicorn.conf.py) the snapshot is loaded once in the master and shared with the forked
+# workers, which start the watcher instead: one of them refreshes, all of them follow the snapshot cache file
+# and the journal, so posts written through one worker show up in the others.
+watcher = SnapshotWatcher(refresher, poll=float(os.getenv("SNAPSHOT_POLL_INTERVAL", 5)),
+                          journal_path=journal.path, on_journal=post_writer.sync)
+if os.getenv("SNAPSHOT_SHARED") != "1":
+    refresher.start()
+
+paginator = Paginator(post_store, int(os.getenv("POSTS_PER_PAGE", 10)))
+# Built in the background on the first search, then kept up to date by whatever changes the store
+search_index = SearchIndex(post_store)
+post_store.on_change(search_index.refresh)
+feeds = Feeds(post_store)
+SITE_URL = os.getenv("SITE_URL")
+
+# Post bodies get responsive, lazily loaded variants of the images in static/uploads
+image_pipeline = ImagePipeline(os.path.join(app.static_folder, "uploads"), os.path.join(CACHE_DIR, "images"))
+
+
+@app.template_filter("responsive_images")
+def responsive_images(body: str) -> str:
+    return image_pipeline.rewrite(body, lambda source_hash, width, name: url_for(
+        "image_variant", source_hash=source_hash, width=width, name=name))
+
+# Rendered pages only change with the dataset, so they are cached per store version
+page_cache = PageCache(int(os.getenv("PAGE_CACHE_BYTES", 32 * 1024 * 1024)))
+# Slugs that 404ed in the current version, so bots probing random urls skip the lookup
+missing_slugs = MissCache()
+
+# Set RATE_LIMIT to allow every client that many requests per second (bursts of RATE_LIMIT_BURST)
+rate_limiter = None
+if float(os.getenv("RATE_LIMIT", 0)) > 0:
+    rate_limiter = RateLimiter(MemoryBackend(), float(os.getenv("RATE_LIMIT")),
+                               int(os.getenv("RATE_LIMIT_BURST")) if os.getenv("RATE_LIMIT_BURST") else None)
+# Assets of the pages themselves and the metrics scraper don't count
+RATE_LIMIT_EXEMPT = ("static", "image_variant", "prometheus_metrics")
+# Number of reverse proxies in front of the app (1 on Heroku), whose X-Forwarded-For tells the client address
+PROXY_COUNT = int(os.getenv("PROXY_COUNT", 0))
+
+# Set PROFILE_SLOW_MS to dump sampled stacks of requests slower than that to PROFILE_DIR
+profiler = None
+if os.getenv("PROFILE_SLOW_MS"):
+    profiler = metrics.SlowRequestProfiler(float(os.getenv("PROFILE_SLOW_MS")) / 1000,
+                                           os.getenv("PROFILE_DIR", os.path.join(CACHE_DIR, "profiles")))
+
+metrics.Collected("brain_snippets_snapshot_age_seconds", "Seconds since the served snapshot was loaded",
+                  lambda: time.time() - post_store.updated_at)
+metrics.Collected("brain_snippets_snapshot_last_fetch_timestamp_seconds", "When n:point was last fetched successfully",
+                  lambda: refresher.fetched_at or 0)
+metrics.Collected("brain_snippets_posts", "Posts in the served snapshot", lambda: len(post_store.posts))
+metrics.Collected("brain_snippets_page_cache_lookups_total", "Rendered page cache lookups by result",
+                  lambda: {(("result", "hit"),): page_cache.hits, (("result", "miss"),): page_cache.misses},
+                  kind="counter")
+metrics.Collected("brain_snippets_page_cache_hit_ratio", "Share of page cache lookups that were hits",
+                  lambda: page_cache.hits / max(1, page_cache.hits + page_cache.misses))
+metrics.Collected("brain_snippets_page_cache_bytes", "Size of the cached pages", lambda: page_cache.size)
+metrics.Collected("brain_snippets_page_renders_coalesced_total",
+                  "Page cache misses that waited for a render of the same page in progress", lambda: page_cache.coalesced,
+                  kind="counter")
+metrics.Collected("brain_snippets_missing_slug_hits_total", "404s answered from the cache of unknown slugs",
+                  lambda: missing_slugs.hits, kind="counter")
+
+
+def client_address(environ) -> str:
+    if PROXY_COUNT:
+        forwarded = [address.strip() for address in environ.get("HTTP_X_FORWARDED_FOR", "").split(",")]
+        if len(forwarded) >= PROXY_COUNT and forwarded[-PROXY_COUNT]:
+            return forwarded[-PROXY_COUNT]
+    return environ.get("REMOTE_ADDR", "")
+
+
+# Seconds the client has to wait if this request is over its rate limit, 0 if it may go through.
+# Every request is checked once, also when the ASGI app checked it before handing it to Flask.
+def rate_limited(endpoint: str, environ) -> float:
+    if rate_limiter is None or endpoint in RATE_LIMIT_EXEMPT or environ.get("brain_snippets.rate_checked"):
+        return 0
+    environ["brain_snippets.rate_checked"] = True
+    wait = rate_limiter.check(client_address(environ))
+    if wait:
+        metrics.RATE_LIMITED.inc(endpoint=endpoint or "none")
+    return wait
+
+
+@app.before_request
+def start_timing():
+    g.request_started = time.perf_counter()
+    metrics.start_request()
+    if profiler is not None:
+        profiler.begin()
+
+
+@app.before_request
+def limit_rate():
+    wait = rate_limited(request.endpoint, request.environ)
+    if wait:
+        abort(429, retry_after=math.ceil(wait))
+
+
+@app.after_request
+def add_timing(response):
+    duration = time.perf_counter() - g.request_started
+    response.headers["Server-Timing"] = metrics.finish_request(
+        duration, request.endpoint or "none", request.method, response.status_code)
+    return response
+
+
+@app.teardown_request
+def end_profile(exception=None):
+    if profiler is not None:
+        profiler.end(f"{request.method} {request.path}")
+
+
+def render(template: str, **context) -> str:
+    with metrics.phase("render"):
+        return render_template(template, **context)
+
+
+# The editor pages, see admin.py for how they stay out of the read path
+app.register_blueprint(admin_blueprint(post_store, post_writer, render))
+
+
+def cached_page(key, render_page):
+    # Compressing, hashing and wrapping the page count as serialization, the rendering inside it doesn't
+    with metrics.phase("serialization"):
+        page, hit = page_cache.get_or_render(key, post_store.version, render_page, post_store.updated_at)
+        body, encoding, etag = page.negotiate(request.accept_encodings)
+
+        response = make_response(body)
+        if encoding:
+            response.content_encoding = encoding
+        response.vary.add("Accept-Encoding")
+        response.set_etag(etag)
+        response.last_modified = page.last_modified
+        response.cache_control.public = True
+        response.cache_control.max_age = int(os.getenv("PAGE_MAX_AGE", 60))
+        response.headers["X-Cache"] = "HIT" if hit else "MISS"
+        # Turns the response into a 304 if the client's If-None-Match / If-Modified-Since still hold
+        return response.make_conditional(request)
+
 
 @app.route('/')
 def get_all_posts():
-    page = int(request.args.get("page", 1))
-    start = (page - 1) * 10
-    end = page * 10
-    posts = blog_data[start:end]
-    if not posts:
-        page = 1
-        start = 0
-        end = 10
-        posts = blog_data[start:end]
-    return render_template("index.html", all_posts=posts, page=page)
+    # Older pages are addressed by the id of the last post on the previous page, plain page numbers still work
+    with metrics.phase("lookup"):
+        page = paginator.after(request.args.get("after", type=int)) if "after" in request.args else \
+            paginator.page(request.args.get("page", 1, type=int))
+    # Out of range page numbers and unknown cursors (e.g. a stale "Older Posts" link) don't silently show page 1
+    if page is None:
+        abort(404)
+
+    # Pending flash messages are part of the index page, so it can't come from the cache. Only look into the
+    # session if there is a session cookie: touching it adds "Vary: Cookie", which keeps CDNs from caching the page.
+    if app.config["SESSION_COOKIE_NAME"] in request.cookies and session.get("_flashes"):
+        return render("index.html", all_posts=page.posts, page=page)
+    key = ("index", page.number, page.posts[0].id if page.posts else None)
+    return cached_page(key, lambda: render("index.html", all_posts=page.posts, page=page))
+
+
+@app.route("/search")
+def search():
+    query = request.args.get("q", "").strip()
+    with metrics.phase("lookup"):
+        found = search_index.search(query) if query else []
+        results = [(post, search_index.snippet(post, query)) for post, _ in found or ()]
+    return render("search.html", query=query, results=results, indexing=found is None)
+
+
+@app.route("/metrics")
+def prometheus_metrics():
+    response = make_response(metrics.render())
+    response.content_type = "text/plain; version=0.0.4; charset=utf-8"
+    return response
+
+
+# Absolute url of the site in sitemaps and the feed. Set SITE_URL to not take it from the request's Host header.
+def site_root() -> str:
+    return SITE_URL.rstrip("/") + "/" if SITE_URL else request.url_root
+
+
+def xml_document(document):
+    if document is None:
+        abort(404)
+    response = app.response_class(document.stream(), mimetype="application/xml")
+    response.set_etag(document.etag)
+    response.cache_control.public = True
+    response.cache_control.max_age = int(os.getenv("PAGE_MAX_AGE", 60))
+    return response.make_conditional(request)
+
+
+@app.route("/sitemap.xml")
+def sitemap():
+    return xml_document(feeds.sitemap(site_root()))
+
+
+# Only used when there are too many posts for one sitemap, /sitemap.xml is an index of these then
+@app.route("/sitemap-<int:number>.xml")
+def sitemap_part(number):
+    return xml_document(feeds.sitemap(site_root(), number))
+
+
+@app.route("/feed.xml")
+def feed():
+    return xml_document(feeds.feed(site_root()))
+
+
+@app.route("/img/<source_hash>/<int:width>/<name>")
+def image_variant(source_hash, width, name):
+    filename, _, fmt = name.rpartition(".")
+    path = image_pipeline.variant_file(filename, source_hash, width, fmt)
+    if path is None:
+        abort(404)
+    if not os.path.exists(path):
+        # Not generated yet: the background thread encodes it, until then the original stands in (uncached)
+        image_pipeline.schedule(filename)
+        response = redirect(url_for("static", filename=f"uploads/{filename}"), 307)
+        response.cache_control.no_store = True
+        return response
+    # Variant urls contain the source hash, so they never change content
+    response = send_file(path, mimetype=f"image/{fmt}", max_age=365 * 24 * 3600)
+    response.cache_control.immutable = True
+    return response
 
 
 @app.route("/<post_title>", methods=["GET", "POST"])
 def show_post(post_title):
-    # Convert the post_title to lowercase and replace spaces with dashes
-    post_title = post_title.lower().replace(' ', '-')
-
-    # Find the requested post
-    requested_post = [post for post in blog_data if
-                      post["title"].lower().replace(' ', '-') == post_title]
-
-    return render_template("post.html", post=requested_post[0])
-
-@app.route("/new-post", methods=["GET", "POST"])
-def add_new_post():
-    form = CreatePostForm()
-    if form.validate_on_submit():
-
-        new_post_data = {
-            "id": 0,
-            "title": form.title.data,
-            "subtitle": form.subtitle.data,
-            "date": date.today().strftime("%B %d, %Y"),
-            "author": form.author.data,
-            "image_url": form.img_url.data,
-            "body": form.body.data,
-        }
-
-        dump_and_copy(new_post_data)
-
-        return redirect(url_for("get_all_posts"))
-    return render_template("make-post.html", form=form)
-
-@app.route("/edit-post/<int:post_id>", methods=["GET", "POST"])
-def edit_post(post_id):
-    post = [post for post in blog_data if post["id"] == post_id][0]
-    form = CreatePostForm(
-        title=post["title"],
-        subtitle=post["subtitle"],
-        img_url=post["image_url"],
-        author=post["author"],
-        body=post["body"]
-    )
-    if form.validate_on_submit():
-        post["title"] = form.title.data
-        post["subtitle"] = form.subtitle.data
-        post["image_url"] = form.img_url.data
-        post["author"] = form.author.data
-        post["body"] = form.body.data
-
-        dump_and_copy(post)
-
-        return redirect(url_for("get_all_posts"))
-    return render_template("make-post.html", form=form)
-
-def dump_and_copy(data: dict):
-    # Convert the dictionary to a JSON string
-    json_data = json.dumps(data, indent=2)
-
-    try:
-        # Copy the JSON data to the clipboard
-        pyperclip.copy(json_data)
-        flash(f"Post copied to clipboard as json.")
-    except pyperclip.PyperclipException:
-        flash("Failed to copy post to clipboard. Please copy manually.")
+    with metrics.phase("lookup"):
+        version = post_store.version
+        requested_post = None if missing_slugs.has(post_title, version) else post_store.get_by_slug(post_title)
+    if requested_post is None:
+        missing_slugs.add(post_title, version)
+        abort(404)
+
+    return cached_page(("post", post_store.slug_for(requested_post)),
+                       lambda: render("post.html", post=requested_post))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,227 @@
+# Request timing and counters, rendered in the Prometheus text format by /metrics, without extra dependencies.
+# Requests are split into phases (lookup, render, serialization); each phase only counts its own time,
+# not that of phases nested in it, and the split of a request is also sent back as a Server-Timing header.
+import os
+import sys
+import threading
+import time
+from collections import Counter as Tally
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+REGISTRY = []
+
+
+def format_labels(labels) -> str:
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in labels)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(labels, escaped)) + "}"
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    # (sample name, labels as sorted (name, value) pairs, value)
+    def samples(self):
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str):
+        super().__init__(name, help)
+        self._values = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, labels, value) for labels, value in self._values.items()]
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, buckets: tuple = BUCKETS):
+        super().__init__(name, help)
+        self.buckets = buckets
+        self._values = {}
+
+    def observe(self, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                # One count per bucket, then +Inf, then the sum
+                counts = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            else:
+                counts[len(self.buckets)] += 1
+            counts[-1] += value
+
+    def samples(self):
+        with self._lock:
+            values = [(labels, list(counts)) for labels, counts in self._values.items()]
+        result = []
+        for labels, counts in values:
+            total = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                total += count
+                result.append((f"{self.name}_bucket", labels + (("le", bound),), total))
+            result.append((f"{self.name}_sum", labels, counts[-1]))
+            result.append((f"{self.name}_count", labels, total))
+        return result
+
+
+# A value read when /metrics is scraped. `read` returns a number or a dict of {labels dict as tuple: number}.
+class Collected(Metric):
+    def __init__(self, name: str, help: str, read, kind: str = "gauge"):
+        super().__init__(name, help)
+        self.read = read
+        self.kind = kind
+
+    def samples(self):
+        value = self.read()
+        if isinstance(value, dict):
+            return [(self.name, tuple(sorted(labels)), number) for labels, number in value.items()]
+        return [(self.name, (), value)]
+
+
+def render() -> str:
+    lines = []
+    for metric in REGISTRY:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        for name, labels, value in metric.samples():
+            lines.append(f"{name}{format_labels(labels)} {value}")
+    return "\n".join(lines) + "\n"
+
+
+REQUEST_SECONDS = Histogram("brain_snippets_request_duration_seconds", "Time to build a response, by route")
+PHASE_SECONDS = Histogram("brain_snippets_phase_duration_seconds", "Time spent in each phase of a request")
+SNAPSHOT_FETCH_SECONDS = Histogram("brain_snippets_snapshot_fetch_duration_seconds",
+                                   "Time to fetch and load the n:point bin", buckets=(0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30))
+SNAPSHOT_FETCH_ERRORS = Counter("brain_snippets_snapshot_fetch_errors_total", "Failed n:point fetches")
+BODY_CACHE_LOOKUPS = Counter("brain_snippets_body_cache_lookups_total", "Post body lookups by result")
+RATE_LIMITED = Counter("brain_snippets_rate_limited_total", "Requests rejected by the rate limiter, by route")
+
+# {phase: seconds} of the request being handled, works for threads and asyncio tasks alike
+_timings = ContextVar("timings", default=None)
+_open_phases = ContextVar("open_phases", default=None)
+
+
+def start_request():
+    _timings.set({})
+    _open_phases.set([])
+
+
+@contextmanager
+def phase(name: str):
+    open_phases = _open_phases.get()
+    if open_phases is None:
+        open_phases = []
+        _open_phases.set(open_phases)
+    start = time.perf_counter()
+    # Time of the phases nested in this one, subtracted from its own
+    open_phases.append(0.0)
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        own = elapsed - open_phases.pop()
+        if open_phases:
+            open_phases[-1] += elapsed
+        timings = _timings.get()
+        if timings is not None:
+            timings[name] = timings.get(name, 0.0) + own
+        PHASE_SECONDS.observe(own, phase=name)
+
+
+@contextmanager
+def timed(histogram: Histogram, **labels):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        histogram.observe(time.perf_counter() - start, **labels)
+
+
+# Record the request and return its Server-Timing header value
+def finish_request(duration: float, endpoint: str, method: str, status: int) -> str:
+    REQUEST_SECONDS.observe(duration, endpoint=endpoint, method=method, status=status)
+    timings = _timings.get() or {}
+    _timings.set(None)
+    parts = [f"{name};dur={seconds * 1000:.2f}" for name, seconds in timings.items()]
+    parts.append(f"total;dur={duration * 1000:.2f}")
+    return ", ".join(parts)
+
+
+# Opt-in sampling profiler: every `interval` seconds it records the stack of each thread that is serving a request,
+# and writes the samples of requests slower than `threshold` seconds to `out_dir` as collapsed stacks
+# (one "frame;frame;frame count" line per stack, the input of flamegraph.pl and speedscope).
+class SlowRequestProfiler:
+    def __init__(self, threshold: float, out_dir: str, interval: float = 0.005):
+        self.threshold = threshold
+        self.out_dir = out_dir
+        self.interval = interval
+        self._active = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def begin(self):
+        with self._lock:
+            self._active[threading.get_ident()] = (time.perf_counter(), Tally())
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="slow-request-profiler", daemon=True)
+                self._thread.start()
+
+    # Returns the path of the written profile, if the request was slow enough
+    def end(self, label: str):
+        with self._lock:
+            started = self._active.pop(threading.get_ident(), None)
+        if started is None:
+            return None
+        duration = time.perf_counter() - started[0]
+        if duration < self.threshold or not started[1]:
+            return None
+        os.makedirs(self.out_dir, exist_ok=True)
+        name = "".join(char if char.isalnum() else "_" for char in label).strip("_")[:80]
+        path = os.path.join(self.out_dir, f"{time.strftime('%Y%m%d-%H%M%S')}-{duration * 1000:.0f}ms-{name}.folded")
+        with open(path, "w") as file:
+            file.writelines(f"{stack} {count}\n" for stack, count in started[1].items())
+        return path
+
+    def _run(self):
+        own = threading.get_ident()
+        while True:
+            time.sleep(self.interval)
+            frames = sys._current_frames()
+            with self._lock:
+                for ident, (_, samples) in self._active.items():
+                    frame = frames.get(ident)
+                    if frame is not None and ident != own:
+                        samples[self._collapse(frame)] += 1
+
+    @staticmethod
+    def _collapse(frame) -> str:
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+            frame = frame.f_back
+        return ";".join(reversed(stack))
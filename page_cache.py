@@ -0,0 +1,162 @@
+import gzip
+import hashlib
+import threading
+from collections import OrderedDict
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+# A rendered page with its validator and precompressed variants, so compression happens once per render
+class CachedPage:
+    __slots__ = ("body", "etag", "last_modified", "variants", "size")
+
+    def __init__(self, body: bytes, last_modified: float = None):
+        self.body = body
+        self.etag = hashlib.sha256(body).hexdigest()[:32]
+        self.last_modified = last_modified
+        self.variants = {"gzip": gzip.compress(body, compresslevel=6, mtime=0)}
+        if brotli is not None:
+            self.variants["br"] = brotli.compress(body, quality=9)
+        self.size = len(body) + sum(len(variant) for variant in self.variants.values())
+
+    # Smallest variant the client accepts as (body, content encoding, etag). Every encoding gets its own strong etag.
+    def negotiate(self, accept_encodings):
+        best = (self.body, None, self.etag)
+        for encoding, variant in self.variants.items():
+            if encoding in accept_encodings and len(variant) < len(best[0]):
+                best = (variant, encoding, f"{self.etag}-{encoding}")
+        return best
+
+
+class Flight:
+    __slots__ = ("done", "page")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.page = None
+
+
+# LRU cache of rendered pages, bounded by the total size of the cached bodies.
+# Entries belong to one dataset version; a newer version drops everything rendered for the old one.
+class PageCache:
+    def __init__(self, max_bytes: int = 32 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        # Misses that waited for a render of the same page already in progress instead of rendering it again
+        self.coalesced = 0
+        self.version = None
+        self._entries = OrderedDict()
+        # {(key, version): Flight} of the renders in progress
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    # `count_miss=False` for lookups that fall back to get_or_render, so the miss isn't counted twice
+    def get(self, key, version, count_miss: bool = True):
+        with self._lock:
+            if self.version is None or version > self.version:
+                self._reset(version)
+            page = self._entries.get(key) if version == self.version else None
+            if page is None:
+                self.misses += count_miss
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return page
+
+    def put(self, key, version, page: CachedPage):
+        if page.size > self.max_bytes:
+            return
+        with self._lock:
+            if version != self.version:
+                return
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size -= old.size
+            self._entries[key] = page
+            self.size += page.size
+            while self.size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= evicted.size
+
+    # Returns the cached page for key, rendering and caching it on a miss, and whether it was a hit.
+    # Concurrent misses for the same page render it once: the first one renders, the others wait for its result.
+    def get_or_render(self, key, version, render, last_modified: float = None, wait: float = 10):
+        page = self.get(key, version)
+        if page is not None:
+            return page, True
+        with self._lock:
+            flight = self._flights.get((key, version))
+            leader = flight is None
+            if leader:
+                flight = self._flights[(key, version)] = Flight()
+            else:
+                self.coalesced += 1
+        if not leader:
+            # A render that takes longer than `wait` (or failed) doesn't hold up the others any longer
+            if flight.done.wait(wait) and flight.page is not None:
+                return flight.page, False
+            return CachedPage(render().encode(), last_modified), False
+        try:
+            page = flight.page = CachedPage(render().encode(), last_modified)
+            self.put(key, version, page)
+            return page, False
+        finally:
+            with self._lock:
+                del self._flights[(key, version)]
+            flight.done.set()
+
+    def clear(self):
+        with self._lock:
+            self._reset(self.version)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "entries": len(self._entries),
+                "bytes": self.size,
+                "max_bytes": self.max_bytes,
+            }
+
+    def _reset(self, version):
+        self._entries.clear()
+        self.size = 0
+        self.version = version
+
+
+# Bounded LRU set of keys known not to exist in one dataset version, e.g. slugs that 404.
+# Like PageCache, a newer version forgets all of them, so a post published under such a slug shows up at once.
+class MissCache:
+    def __init__(self, max_entries: int = 10000):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.version = None
+        self._keys = OrderedDict()
+        self._lock = threading.Lock()
+
+    def has(self, key, version) -> bool:
+        with self._lock:
+            if version != self.version or key not in self._keys:
+                return False
+            self._keys.move_to_end(key)
+            self.hits += 1
+            return True
+
+    def add(self, key, version):
+        with self._lock:
+            if self.version is None or version > self.version:
+                self._keys.clear()
+                self.version = version
+            if version != self.version:
+                return
+            self._keys[key] = None
+            self._keys.move_to_end(key)
+            if len(self._keys) > self.max_entries:
+                self._keys.popitem(last=False)
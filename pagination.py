@@ -0,0 +1,81 @@
+import threading
+from typing import NamedTuple
+
+
+# The fields the index page shows, without the post body
+class PostPreview(NamedTuple):
+    id: int
+    title: str
+    subtitle: str
+    author: str
+    date: str
+    slug: str
+
+
+class Page(NamedTuple):
+    number: int
+    posts: tuple
+    total_pages: int
+    next_cursor: int = None
+
+    @property
+    def has_next(self) -> bool:
+        return self.next_cursor is not None
+
+
+# Splits the store into pages of previews once per store version.
+# Besides page numbers, pages can be addressed by a cursor (the id of the last post seen),
+# which keeps "Older Posts" links stable when new posts are added in front.
+class Paginator:
+    def __init__(self, store, page_size: int = 10):
+        self.store = store
+        self.page_size = page_size
+        self._version = None
+        # (previews, position of each post id), swapped as a whole when the store changes
+        self._state = ((), {})
+        self._lock = threading.Lock()
+
+    @property
+    def total_pages(self) -> int:
+        previews, _ = self._build()
+        return self._total_pages(previews)
+
+    # Page by 1-based number, None if it's out of range
+    def page(self, number: int):
+        previews, _ = self._build()
+        if not 1 <= number <= self._total_pages(previews):
+            return None
+        return self._slice(previews, (number - 1) * self.page_size)
+
+    # Page of the posts following the post with id `cursor`, None if the cursor is unknown or the last post
+    def after(self, cursor: int):
+        previews, positions = self._build()
+        position = positions.get(cursor)
+        if position is None or position + 1 >= len(previews):
+            return None
+        return self._slice(previews, position + 1)
+
+    def _total_pages(self, previews: tuple) -> int:
+        return max(1, -(-len(previews) // self.page_size))
+
+    def _slice(self, previews: tuple, start: int) -> Page:
+        posts = previews[start:start + self.page_size]
+        end = start + len(posts)
+        next_cursor = posts[-1].id if posts and end < len(previews) else None
+        return Page(start // self.page_size + 1, posts, self._total_pages(previews), next_cursor)
+
+    def _build(self) -> tuple:
+        if self._version == self.store.version:
+            return self._state
+        with self._lock:
+            version = self.store.version
+            if self._version != version:
+                previews = tuple(
+                    PostPreview(post.id, post.title, post.subtitle, post.author, post.date, post.slug)
+                    for post in self.store.posts
+                )
+                positions = {}
+                for position, preview in enumerate(previews):
+                    positions.setdefault(preview.id, position)
+                self._state, self._version = (previews, positions), version
+            return self._state
@@ -0,0 +1,48 @@
+# Token bucket rate limiting per client. Every client gets `burst` tokens that refill at `rate` per second,
+# and each request takes one. The buckets live in a backend: MemoryBackend keeps them in the process (so with
+# several workers every worker has its own), a RateLimitBackend subclass can keep them somewhere shared instead.
+import threading
+import time
+from collections import OrderedDict
+
+
+class RateLimitBackend:
+    # Takes a token from the bucket of key. Returns 0 if there was one, otherwise the seconds until there is.
+    def take(self, key: str, rate: float, burst: int) -> float:
+        raise NotImplementedError
+
+
+class MemoryBackend(RateLimitBackend):
+    def __init__(self, max_clients: int = 100000):
+        self.max_clients = max_clients
+        # {key: (tokens, time of the last update)}, least recently seen client first
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key: str, rate: float, burst: int) -> float:
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated) * rate)
+            wait = 0.0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                wait = (1 - tokens) / rate
+            self._buckets[key] = (tokens, now)
+            # The least recently seen clients have the fullest buckets, forgetting them lets them start over at
+            # `burst`, which is where they would be by now anyway
+            while len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+        return wait
+
+
+class RateLimiter:
+    def __init__(self, backend: RateLimitBackend, rate: float, burst: int = None):
+        self.backend = backend
+        self.rate = rate
+        self.burst = burst if burst is not None else max(1, int(rate * 10))
+
+    # Seconds the client has to wait before its next request, 0 if this one may go through
+    def check(self, client: str) -> float:
+        return self.backend.take(client, self.rate, self.burst)
@@ -0,0 +1,123 @@
+# Decoding of n:point bins into validated post dicts, with the fastest JSON library installed:
+# msgspec (decodes and validates in one pass), orjson, or the standard library.
+# Posts that don't match static/schema.json are logged and left out instead of failing later in a request.
+import json
+import logging
+import os
+from typing import TypedDict, Union
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+SCHEMA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static", "schema.json")
+
+with open(SCHEMA_PATH, "r") as file:
+    FIELDS = tuple(json.load(file))
+# The bin has always used numeric ids (schema.json shows one as a string, so numeric strings are accepted too),
+# every other field is text
+STRING_FIELDS = tuple(field for field in FIELDS if field != "id")
+
+
+class SchemaError(ValueError):
+    pass
+
+
+class PostDict(TypedDict):
+    id: Union[int, str]
+    title: str
+    subtitle: str
+    date: str
+    author: str
+    image_url: str
+    body: str
+
+
+if msgspec is not None:
+    _typed_decoder = msgspec.json.Decoder(list[PostDict])
+    _decoder = msgspec.json.Decoder()
+
+
+def parser() -> str:
+    return "msgspec" if msgspec is not None else "orjson" if orjson is not None else "json"
+
+
+def loads(payload: bytes):
+    if msgspec is not None:
+        return _decoder.decode(payload)
+    if orjson is not None:
+        return orjson.loads(payload)
+    return json.loads(payload)
+
+
+def dumps(value) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(value)
+    if msgspec is not None:
+        return msgspec.json.encode(value)
+    return json.dumps(value, separators=(",", ":"), ensure_ascii=False).encode()
+
+
+# Posts of a bin, raises SchemaError if the payload isn't a JSON list
+def decode_posts(payload: bytes) -> list:
+    if msgspec is not None:
+        try:
+            posts = _typed_decoder.decode(payload)
+        except msgspec.ValidationError:
+            # Some entries are off, find out which ones below
+            posts = None
+        except msgspec.DecodeError as error:
+            raise SchemaError(f"Not valid JSON: {error}") from None
+        if posts is not None:
+            if any(isinstance(post["id"], str) for post in posts):
+                return validate(posts)
+            return posts
+    try:
+        posts = loads(payload)
+    except ValueError as error:
+        raise SchemaError(f"Not valid JSON: {error}") from None
+    return validate(posts)
+
+
+# The valid posts of a decoded bin (string ids turned into ints), logging every one that is left out
+def validate(posts) -> list:
+    if not isinstance(posts, list):
+        raise SchemaError(f"Expected a list of posts, got {type(posts).__name__}")
+    valid = []
+    for position, post in enumerate(posts):
+        problem = _problem(post)
+        if problem is None:
+            if isinstance(post["id"], str):
+                post = dict(post, id=int(post["id"]))
+            valid.append(post)
+        else:
+            post_id = post.get("id") if isinstance(post, dict) else None
+            logger.error("Skipping post #%d (id %r): %s", position, post_id, problem)
+    # Rather keep serving the current posts than none
+    if posts and not valid:
+        raise SchemaError(f"None of the {len(posts)} posts match {os.path.basename(SCHEMA_PATH)}")
+    return valid
+
+
+def _problem(post):
+    if not isinstance(post, dict):
+        return f"expected an object, got {type(post).__name__}"
+    missing = [field for field in FIELDS if field not in post]
+    if missing:
+        return f"missing {', '.join(missing)}"
+    post_id = post["id"]
+    if isinstance(post_id, bool) or not isinstance(post_id, (int, str)) or \
+            (isinstance(post_id, str) and not post_id.strip().isdigit()):
+        return f"id must be a number, got {post_id!r}"
+    for field in STRING_FIELDS:
+        if not isinstance(post[field], str):
+            return f"{field} must be a string, got {type(post[field]).__name__}"
+    return None
@@ -0,0 +1,349 @@
+import bisect
+import heapq
+import html
+import logging
+import math
+import os
+import re
+import threading
+from array import array
+from collections import Counter, deque
+from itertools import chain, compress, filterfalse, repeat
+from operator import add, eq, mul, truediv
+from markupsafe import Markup, escape
+
+from snapshot import release_memory
+
+TOKEN = re.compile(r"\w+")
+TAG = re.compile(r"<[^>]*>")
+
+logger = logging.getLogger(__name__)
+
+# Matches in the title count more than in the subtitle, and those more than in the body (weight 1)
+FIELD_WEIGHTS = (("title", 3), ("subtitle", 2))
+# Query words also match longer indexed words starting with them, at a discount
+PREFIX_WEIGHT = 0.5
+MAX_PREFIX_TERMS = 50
+# BM25 term frequency parts are stored as 16 bit fractions of their maximum, k1 + 1
+IMPACT_STEPS = 65535
+# Postings of a term kept ordered by impact. Deeper than that a query scores every posting instead.
+RANKED_POSTINGS = 4096
+# Terms in at least this share of the posts store an impact for every post (0 where it's missing) instead:
+# that takes less memory than doc ids and impacts, and looking a post up needs no bisect
+DENSE_SHARE = 1 / 3
+# Posts changed since the last build are indexed on the side; past this share of the posts the index is rebuilt
+MAX_CHANGED_SHARE = 0.1
+MIN_CHANGED_REBUILD = 64
+
+
+def strip_html(text: str) -> str:
+    return html.unescape(TAG.sub(" ", text))
+
+
+def tokenize(text: str) -> list:
+    return TOKEN.findall(text.lower())
+
+
+# Weighted term frequencies of a post. Reads the body around the body cache, indexing every post would flush it.
+def post_terms(post) -> Counter:
+    terms = Counter(tokenize(strip_html(post.body_bytes().decode())))
+    for field, weight in FIELD_WEIGHTS:
+        for term, count in Counter(tokenize(getattr(post, field))).items():
+            terms[term] += count * weight
+    return terms
+
+
+# Postings of a list of posts, built once and never changed: per term (sorted, so prefixes are a bisect away)
+# the doc ids in ascending order, their quantized BM25 term frequency parts, and the positions of the
+# RANKED_POSTINGS highest ones, best first. Dense terms have no doc ids, their impacts and ranking are per doc id.
+class Segment:
+    # The loops over every posting run in C (map, deque), a Python loop per posting would be most of the build
+    def __init__(self, posts: list, k1: float, b: float):
+        doc_lists, tf_lists, lengths = {}, {}, array("f")
+        for doc, post in enumerate(posts):
+            terms = post_terms(post)
+            for term in filterfalse(doc_lists.__contains__, terms):
+                doc_lists[term], tf_lists[term] = array("I"), array("f")
+            deque(map(array.append, map(doc_lists.__getitem__, terms), repeat(doc)), maxlen=0)
+            deque(map(array.append, map(tf_lists.__getitem__, terms), terms.values()), maxlen=0)
+            lengths.append(sum(terms.values()))
+
+        self.size = len(lengths)
+        self.avg_length = sum(lengths) / len(lengths) if lengths else 1.0
+        norms = array("f", [k1 * (1 - b + b * length / self.avg_length) for length in lengths])
+        self.terms = sorted(doc_lists)
+        self.docs, self.impacts, self.ranked, self.frequencies = [], [], [], array("I")
+        for term in self.terms:
+            docs, tfs = doc_lists.pop(term), tf_lists.pop(term)
+            # IMPACT_STEPS * tf / (tf + norm)
+            ratios = map(truediv, tfs, map(add, tfs, map(norms.__getitem__, docs)))
+            impacts = array("H", map(int, map(mul, ratios, repeat(IMPACT_STEPS))))
+            ranked = sorted(range(len(impacts)), key=impacts.__getitem__, reverse=True)[:RANKED_POSTINGS]
+            self.frequencies.append(len(docs))
+            if len(docs) >= DENSE_SHARE * self.size:
+                dense = array("H", bytes(2 * self.size))
+                deque(map(dense.__setitem__, docs, impacts), maxlen=0)
+                docs, impacts, ranked = None, dense, map(docs.__getitem__, ranked)
+            self.docs.append(docs)
+            self.impacts.append(impacts)
+            self.ranked.append(array("I", ranked))
+
+    def term_id(self, term: str):
+        position = bisect.bisect_left(self.terms, term)
+        return position if position < len(self.terms) and self.terms[position] == term else None
+
+
+# Inverted index over the posts of a PostStore, ranked with BM25.
+# The index is built by a background thread on the first search, so neither startup nor a request waits for it;
+# until then `search` returns None. Later changes of the store (see PostStore.on_change) are applied by the
+# same thread: changed posts go to a small index on the side, and past MAX_CHANGED_SHARE everything is rebuilt.
+class SearchIndex:
+    def __init__(self, store, k1: float = 1.2, b: float = 0.75):
+        self.store = store
+        self.k1 = k1
+        self.b = b
+        self.version = None
+        self._segment = None
+        # Per doc id: the post (None once it changed or went away) and its signature. Ids past the
+        # segment's posts are the changed posts, with their terms in _changed and postings in _changed_postings.
+        self._posts = []
+        self._signatures = []
+        self._slugs = {}
+        self._changed = {}
+        self._changed_postings = {}
+        self._changed_terms = []
+        self._changed_lengths = {}
+        self._stale = 0
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self._wake = None
+        self._pid = None
+
+    @property
+    def ready(self) -> bool:
+        return self._segment is not None
+
+    # Bring the index up to date in the background, once it's in use
+    def refresh(self):
+        if self._pid == os.getpid():
+            self._schedule()
+
+    # Bring the index up to date with the store on the calling thread
+    def sync(self):
+        with self._sync_lock:
+            version = self.store.version
+            if self.version == version:
+                return
+            posts = self.store.posts
+            if self._segment is None or self._stale > max(MIN_CHANGED_REBUILD, MAX_CHANGED_SHARE * len(self._slugs)):
+                segment = Segment(posts, self.k1, self.b)
+                with self._lock:
+                    self._install(segment, posts)
+                # Hand the build's scratch memory (and the replaced segment) back to the OS
+                release_memory()
+            else:
+                self._update(posts)
+            self.version = version
+
+    # Top `limit` posts for the query as (post, score), best first. None while the index is being built.
+    # Uses the threshold algorithm over the impact-ordered postings, so common words don't mean scoring every post.
+    def search(self, query: str, limit: int = 20):
+        if self.version != self.store.version:
+            self._schedule()
+        with self._lock:
+            segment = self._segment
+            if segment is None:
+                return None
+            # Postings of changed posts stay in the segment until the next build. Like the number of posts,
+            # the document frequencies count them until then, which keeps the two consistent.
+            doc_count = segment.size + len(self._changed)
+            lists = []
+            changed_scores = Counter()
+            for term, weight in self._expand(tokenize(query)).items():
+                tid = segment.term_id(term)
+                changed = self._changed_postings.get(term, {})
+                frequency = (segment.frequencies[tid] if tid is not None else 0) + len(changed)
+                boost = weight * math.log(1 + (doc_count - frequency + 0.5) / (frequency + 0.5)) * (self.k1 + 1)
+                if tid is not None:
+                    lists.append((boost / IMPACT_STEPS, segment.docs[tid], segment.impacts[tid], segment.ranked[tid],
+                                  segment.frequencies[tid]))
+                for doc, tf in changed.items():
+                    changed_scores[doc] += boost * tf / (tf + self._norm(self._changed_lengths[doc]))
+            best = heapq.nlargest(limit, ((score, doc) for doc, score in changed_scores.items()))
+            if lists:
+                best = self._threshold(lists, best, limit)
+            return [(self._posts[doc], score) for score, doc in best]
+
+    # A short excerpt of the post body around the first match, with the matches highlighted
+    def snippet(self, post, query: str, width: int = 160) -> Markup:
+        text = " ".join(strip_html(post.body).split())
+        words = sorted(set(tokenize(query)), key=len, reverse=True)
+        if not words:
+            return escape(text[:width])
+        pattern = re.compile(r"\b(" + "|".join(re.escape(word) for word in words) + r")\w*", re.IGNORECASE)
+        match = pattern.search(text)
+        start = max(0, match.start() - width // 3) if match else 0
+        excerpt = text[start:start + width]
+
+        parts, last = [], 0
+        for found in pattern.finditer(excerpt):
+            parts.append(escape(excerpt[last:found.start()]))
+            parts.append(Markup("<mark>%s</mark>") % found.group(0))
+            last = found.end()
+        parts.append(escape(excerpt[last:]))
+        prefix = "… " if start else ""
+        suffix = " …" if start + width < len(text) else ""
+        return Markup(prefix) + Markup("").join(parts) + Markup(suffix)
+
+    # Walks the lists best impact first, in growing blocks, and scores every new doc fully until no doc further
+    # down can make the top `limit`. Lists are only ranked to RANKED_POSTINGS; if that isn't deep enough every
+    # posting is scored.
+    def _threshold(self, lists: list, best: list, limit: int) -> list:
+        seen, depth, size = set(), 0, 16
+        while True:
+            candidates, threshold, ranked_left, truncated = set(), 0.0, False, False
+            for boost, docs, impacts, ranked, frequency in lists:
+                block = ranked[depth:depth + size]
+                candidates.update(block if docs is None else map(docs.__getitem__, block))
+                if len(block) == size:
+                    threshold += boost * impacts[block[-1]]
+                elif len(ranked) < frequency:
+                    # Whatever wasn't ranked has at most the impact of the last ranked posting
+                    threshold += boost * impacts[ranked[-1]]
+                ranked_left |= depth + size < len(ranked)
+                truncated |= depth + size >= len(ranked) and len(ranked) < frequency
+            candidates -= seen
+            seen |= candidates
+            best = heapq.nlargest(limit, chain(best, self._score(lists, candidates)))
+            depth, size = depth + size, size * 2
+            if len(best) == limit and best[-1][0] >= threshold:
+                return best
+            if not ranked_left:
+                break
+        if truncated:
+            candidates = set().union(*(compress(range(len(impacts)), impacts) if docs is None else docs
+                                       for _, docs, impacts, _, _ in lists)) - seen
+            best = heapq.nlargest(limit, chain(best, self._score(lists, candidates)))
+        return best
+
+    # (score, doc) of the live docs among the candidates. Looks each doc up in every list (with a bisect unless
+    # the term is dense), in C.
+    def _score(self, lists: list, candidates: set):
+        candidates = list(compress(candidates, map(self._posts.__getitem__, candidates)))
+        totals = [0.0] * len(candidates)
+        for boost, docs, impacts, _, _ in lists:
+            if docs is None:
+                found = map(impacts.__getitem__, candidates)
+            else:
+                positions = list(map(bisect.bisect_left, repeat(docs), candidates, repeat(0), repeat(len(docs) - 1)))
+                # The impact where the doc is in the list, 0 where the bisect landed on another doc
+                found = map(mul, map(impacts.__getitem__, positions),
+                            map(eq, map(docs.__getitem__, positions), candidates))
+            totals = list(map(add, totals, map(mul, found, repeat(boost))))
+        return zip(totals, candidates)
+
+    def _norm(self, length: float) -> float:
+        return self.k1 * (1 - self.b + self.b * length / self._segment.avg_length)
+
+    # Index terms each query word stands for, with their weight
+    def _expand(self, words: list) -> dict:
+        weights = {}
+        for word in words:
+            prefixed = set()
+            for terms in (self._segment.terms, self._changed_terms):
+                start = bisect.bisect_left(terms, word)
+                if start < len(terms) and terms[start] == word:
+                    weights[word] = 1.0
+                    start += 1
+                for term in terms[start:start + MAX_PREFIX_TERMS]:
+                    if not term.startswith(word):
+                        break
+                    prefixed.add(term)
+            for term in sorted(prefixed)[:MAX_PREFIX_TERMS]:
+                weights.setdefault(term, PREFIX_WEIGHT)
+        return weights
+
+    def _schedule(self):
+        with self._lock:
+            # A thread started before a fork (gunicorn preload) doesn't exist in the worker, each process starts its own
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._wake = threading.Event()
+                threading.Thread(target=self._run, args=(self._wake,), name="search-index", daemon=True).start()
+        self._wake.set()
+
+    def _run(self, wake: threading.Event):
+        while True:
+            wake.wait()
+            wake.clear()
+            try:
+                self.sync()
+            except Exception:
+                logger.exception("Updating the search index failed")
+
+    @staticmethod
+    def _signature(post) -> tuple:
+        return post.title, post.subtitle, post.body_key
+
+    def _install(self, segment: Segment, posts: list):
+        self._segment = segment
+        self._posts = list(posts)
+        self._signatures = [self._signature(post) for post in posts]
+        self._slugs = {post.slug: doc for doc, post in enumerate(posts)}
+        self._changed, self._changed_postings, self._changed_terms, self._changed_lengths = {}, {}, [], {}
+        self._stale = 0
+
+    # Only the sync thread changes the index, so finding and tokenizing the changed posts can run outside the
+    # lock; searches only wait for applying them
+    def _update(self, posts: list):
+        seen, renewed, changed = set(), [], []
+        for post in posts:
+            seen.add(post.slug)
+            doc = self._slugs.get(post.slug)
+            signature = self._signature(post)
+            if doc is not None:
+                indexed = self._posts[doc]
+                if indexed is post and self._signatures[doc] == signature:
+                    continue
+                if indexed is not post and (indexed.title, indexed.subtitle, indexed.body_bytes()) == \
+                        (post.title, post.subtitle, post.body_bytes()):
+                    # Same content in a new record, e.g. after a snapshot refresh that didn't touch this post
+                    renewed.append((doc, post, signature))
+                    continue
+            changed.append((post, signature, post_terms(post)))
+        gone = self._slugs.keys() - seen
+
+        with self._lock:
+            for doc, post, signature in renewed:
+                self._posts[doc], self._signatures[doc] = post, signature
+            for post, signature, terms in changed:
+                if post.slug in self._slugs:
+                    self._remove(post.slug)
+                self._add(post, signature, terms)
+            for slug in gone:
+                self._remove(slug)
+            if changed or gone:
+                self._changed_terms = sorted(self._changed_postings)
+
+    # Index a changed post on the side
+    def _add(self, post, signature: tuple, terms: Counter):
+        doc = len(self._posts)
+        for term, tf in terms.items():
+            self._changed_postings.setdefault(term, {})[doc] = tf
+        self._posts.append(post)
+        self._signatures.append(signature)
+        self._slugs[post.slug] = doc
+        self._changed[doc] = terms
+        self._changed_lengths[doc] = sum(terms.values())
+        self._stale += 1
+
+    def _remove(self, slug: str):
+        doc = self._slugs.pop(slug)
+        self._posts[doc] = self._signatures[doc] = None
+        for term in self._changed.pop(doc, ()):
+            postings = self._changed_postings[term]
+            del postings[doc]
+            if not postings:
+                del self._changed_postings[term]
+        self._changed_lengths.pop(doc, None)
+        self._stale += 1
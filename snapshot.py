@@ -0,0 +1,288 @@
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+import time
+import metrics
+from schema import SchemaError, decode_posts, dumps
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+logger = logging.getLogger(__name__)
+
+CACHE_DIR = os.getenv("SNAPSHOT_CACHE_DIR", os.path.join(tempfile.gettempdir(), "brain-snippets"))
+CACHE_PATH = os.path.join(CACHE_DIR, "snapshot.json")
+BACKUP_PATH = "static/assets/backup.json"
+
+
+# Compact serialized form of the posts, used for hashing and for the cache file
+def compact(posts: list) -> bytes:
+    return dumps(posts)
+
+
+def checksum(payload: bytes) -> str:
+    return hashlib.sha256(payload).hexdigest()
+
+
+_libc = None
+
+
+# Hand the memory freed after parsing a snapshot back to the OS (glibc keeps it otherwise),
+# so it doesn't linger in every worker or get copied into them after a fork
+def release_memory():
+    global _libc
+    if _libc is None:
+        try:
+            import ctypes
+            _libc = ctypes.CDLL("libc.so.6")
+        except (ImportError, OSError):
+            _libc = False
+    if _libc:
+        _libc.malloc_trim(0)
+
+
+# The cache file is the sha256 of the payload on the first line followed by the compact payload
+def save_cached(payload: bytes, path: str = CACHE_PATH):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as file:
+        file.write(checksum(payload).encode() + b"\n" + payload)
+    os.replace(tmp_path, path)
+
+
+# (checksum, posts) of the cache file, None if there is none or it's corrupt
+def read_cached(path: str = CACHE_PATH):
+    try:
+        with open(path, "rb") as file:
+            digest, _, payload = file.read().partition(b"\n")
+    except OSError:
+        return None
+    digest = digest.decode(errors="replace")
+    if digest != checksum(payload):
+        logger.warning("Ignoring snapshot cache %s with a bad checksum", path)
+        return None
+    try:
+        return digest, decode_posts(payload)
+    except SchemaError as error:
+        logger.warning("Ignoring snapshot cache %s: %s", path, error)
+        return None
+
+
+def load_cached(path: str = CACHE_PATH):
+    cached = read_cached(path)
+    return cached[1] if cached else None
+
+
+# Posts to serve right after startup, without touching the network: the last good snapshot, else backup.json
+def load_startup_posts(path: str = CACHE_PATH, backup_path: str = BACKUP_PATH) -> list:
+    posts = load_cached(path)
+    if posts is None:
+        with open(backup_path, "rb") as file:
+            posts = decode_posts(file.read())
+    return posts
+
+
+# Keeps a PostStore in sync with the n:point bin.
+# Readers keep using the current snapshot while a background thread re-fetches it every `interval` seconds.
+class SnapshotRefresher:
+    def __init__(self, url: str, store, interval: float = 300, timeout=(3.05, 10), retries: int = 3,
+                 backoff: float = 1, cache_path: str = CACHE_PATH, overlay=None):
+        self.url = url
+        self.store = store
+        self.interval = interval
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.cache_path = cache_path
+        # Applied to every fetched snapshot before it goes into the store, e.g. to keep local writes on top
+        self.overlay = overlay
+        self.etag = None
+        # When the bin was last fetched successfully, changed or not
+        self.fetched_at = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    # Fetch the bin once. Returns True if the store got new content.
+    def refresh(self) -> bool:
+        # Imported here, it's only needed once the app is up and takes a while to import
+        import requests
+        with metrics.timed(metrics.SNAPSHOT_FETCH_SECONDS):
+            response = requests.get(self.url, headers=self.request_headers(), timeout=self.timeout)
+            if response.status_code != 304:
+                response.raise_for_status()
+            self.fetched_at = time.time()
+            changed = response.status_code != 304 and self.load(response.content, response.headers.get("ETag"))
+        del response
+        if changed:
+            release_memory()
+        return changed
+
+    def request_headers(self) -> dict:
+        return {"If-None-Match": self.etag} if self.etag else {}
+
+    # Put a fetched bin (the raw response body) into the store, unless it's the snapshot already served
+    def load(self, content: bytes, etag: str = None) -> bool:
+        # n:point does not always send an ETag, so compare the payload itself as well
+        posts = decode_posts(content)
+        payload = compact(posts)
+        content_hash = checksum(payload)
+        self.etag = etag
+        if content_hash == self.store.content_hash:
+            return False
+
+        self.apply(posts, content_hash)
+        logger.info("Loaded new snapshot with %d posts", len(posts))
+        try:
+            save_cached(payload, self.cache_path)
+        except OSError:
+            logger.exception("Could not write snapshot cache %s", self.cache_path)
+        return True
+
+    def apply(self, posts: list, content_hash: str):
+        self.store.replace(self.overlay(posts) if self.overlay else posts, content_hash)
+
+    # Refresh with exponential backoff between failed attempts
+    def refresh_with_retry(self) -> bool:
+        for attempt in range(self.retries):
+            try:
+                return self.refresh()
+            except Exception:
+                metrics.SNAPSHOT_FETCH_ERRORS.inc()
+                if attempt == self.retries - 1:
+                    raise
+                logger.warning("Snapshot fetch failed (attempt %d/%d)", attempt + 1, self.retries)
+                if self._stop.wait(self.backoff * 2 ** attempt):
+                    return False
+        return False
+
+    # Reconcile with n:point right away in the background, then every `interval` seconds.
+    # A negative interval keeps the app offline on the startup snapshot.
+    def start(self):
+        if self._thread is not None or self.interval < 0:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="snapshot-refresh", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while True:
+            try:
+                self.refresh_with_retry()
+            except Exception:
+                logger.exception("Snapshot refresh failed, keeping the current one")
+            if self.interval <= 0 or self._stop.wait(self.interval):
+                return
+
+
+# Lets several processes (gunicorn workers) share one refresher: whichever worker holds the refresh lock
+# fetches from n:point, and every worker picks up new snapshots from the cache file it writes.
+# Posts written through another worker land in the journal at `journal_path`; `on_journal` is called whenever
+# that file changes, to apply them to this worker's store.
+class SnapshotWatcher:
+    def __init__(self, refresher: SnapshotRefresher, poll: float = 5, journal_path: str = None, on_journal=None):
+        self.refresher = refresher
+        self.poll = poll
+        self.journal_path = journal_path
+        self.on_journal = on_journal
+        self.leader = False
+        self._lock_file = None
+        self._seen = None
+        self._journal_seen = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="snapshot-watch", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.refresher.stop()
+
+    # Load the cache file into the store if another process wrote a snapshot we don't have yet
+    def check(self) -> bool:
+        path = self.refresher.cache_path
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return False
+        if (stat.st_mtime_ns, stat.st_size) == self._seen:
+            return False
+        self._seen = (stat.st_mtime_ns, stat.st_size)
+        # Only the first line is needed to tell whether it's the snapshot we already serve
+        try:
+            with open(path, "rb") as file:
+                if file.readline().strip().decode(errors="replace") == self.refresher.store.content_hash:
+                    return False
+        except OSError:
+            return False
+        cached = read_cached(path)
+        if cached is None or cached[0] == self.refresher.store.content_hash:
+            return False
+        self.refresher.apply(cached[1], cached[0])
+        logger.info("Picked up snapshot %s from %s", cached[0][:12], path)
+        del cached
+        release_memory()
+        return True
+
+    # Apply the journal if it changed since the last look
+    def check_journal(self) -> bool:
+        if self.on_journal is None:
+            return False
+        try:
+            stat = os.stat(self.journal_path)
+        except OSError:
+            return False
+        if (stat.st_mtime_ns, stat.st_size) == self._journal_seen:
+            return False
+        self._journal_seen = (stat.st_mtime_ns, stat.st_size)
+        return self.on_journal()
+
+    def _run(self):
+        while True:
+            if not self.leader:
+                self._try_lead()
+            try:
+                self.check()
+            except Exception:
+                logger.exception("Could not load the shared snapshot")
+            try:
+                self.check_journal()
+            except Exception:
+                logger.exception("Could not apply the journal")
+            if self._stop.wait(self.poll):
+                return
+
+    def _try_lead(self):
+        if fcntl is None:
+            self.leader = True
+        else:
+            os.makedirs(os.path.dirname(self.refresher.cache_path), exist_ok=True)
+            lock_file = open(f"{self.refresher.cache_path}.refresh.lock", "w")
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                lock_file.close()
+                return
+            # Held until the process exits, then another worker takes over
+            self._lock_file = lock_file
+            self.leader = True
+        logger.info("Process %d refreshes the snapshot for all workers", os.getpid())
+        self.refresher.start()
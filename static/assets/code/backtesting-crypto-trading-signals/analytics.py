@@ -0,0 +1,114 @@
+# Balance paths and risk metrics of backtest results, for any number of result sets at once.
+# A result set is a sequence of trade returns: a CSV of simulate_trades, or one strategy of a sweep. Trades are
+# kept in one long DataFrame (set, profit, closed_at); balances compound in closed form as a cumulative product per
+# set, and the metrics of all sets come from grouped operations, without a Python loop over trades.
+# Nothing here imports matplotlib, plot_graphs in main.py draws these numbers.
+# Usage: python analytics.py [results/ | results/sweep.parquet] [--output summary.csv]
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+INITIAL = 1000
+MARGIN = 0.02
+TAKER_FEE = 0.001  # 0.1%
+FUNDING_FEE = 0.0002  # 0.02%
+LEVERAGE = 10
+AVG_FUNDING_CYCLES_PER_TRADE = 3  # 24h Avg. Trade Length
+# Assumed risk-free rate per day (in percent)
+RISK_FREE_RATE = 3 / 365
+
+
+# Trades of every CSV of simulate_trades in directory, the file name (without .csv) is the set
+def load_csvs(directory: str) -> pd.DataFrame:
+    frames = []
+    for name in sorted(os.listdir(directory)):
+        if name.endswith('.csv'):
+            df = pd.read_csv(os.path.join(directory, name))
+            frames.append(pd.DataFrame({
+                'set': os.path.splitext(name)[0],
+                'profit': df['Profit'] / 100,
+                'closed_at': pd.to_datetime(df['Closed at']).dt.date,
+            }))
+    if not frames:
+        raise ValueError(f"No CSV files of simulate_trades in {directory}")
+    return pd.concat(frames, ignore_index=True)
+
+
+# Trades of a sweep.py results file, one set per strategy. Its net ROI already has the fees of the strategy
+# subtracted, so balances of these are computed with `fees=False`.
+def load_sweep(path: str) -> pd.DataFrame:
+    from sweep import load_results
+    results = load_results(path)
+    return pd.DataFrame({
+        'set': results['strategy'],
+        'profit': results['net_roi'] / 100,
+        'closed_at': pd.to_datetime(results['close_time']).dt.date,
+    })
+
+
+# Adds the account balance after each trade: every trade risks MARGIN of the balance. With fees, the first trade
+# pays the taker fee on the whole balance, every later one pays it and the funding of LEVERAGE on its margin.
+def with_balance(trades: pd.DataFrame, fees: bool = True) -> pd.DataFrame:
+    margin_return = MARGIN * trades['profit'].to_numpy(dtype=np.float64)
+    if fees:
+        factors = 1 + margin_return - MARGIN * LEVERAGE * FUNDING_FEE * AVG_FUNDING_CYCLES_PER_TRADE \
+            - MARGIN * TAKER_FEE
+        first = trades.groupby('set', sort=False).cumcount().to_numpy() == 0
+        factors[first] = (1 + margin_return[first]) * (1 - TAKER_FEE)
+    else:
+        factors = 1 + margin_return
+    growth = pd.Series(factors, index=trades.index).groupby(trades['set'], sort=False).cumprod()
+    return trades.assign(balance=INITIAL * growth)
+
+
+# One row of metrics per set: returns are per trade, Sharpe ratio against RISK_FREE_RATE, drawdowns from the
+# running maximum of the balance
+def summary(trades: pd.DataFrame) -> pd.DataFrame:
+    sets = trades['set']
+    balance = trades['balance']
+    by_set = balance.groupby(sets, sort=False)
+    returns = (balance / by_set.shift() - 1).groupby(sets, sort=False)
+    running_max = by_set.cummax()
+    drawdown = ((running_max - balance) / running_max).groupby(sets, sort=False)
+
+    stats = pd.DataFrame({
+        'trades': by_set.size(),
+        'trading_days': trades.groupby('set', sort=False)['closed_at'].nunique(),
+        'final_balance': by_set.last(),
+        'avg_daily_roi': returns.mean() * 100,
+        'volatility': returns.std(ddof=0) * 100,
+        'max_drawdown_percent': drawdown.max() * 100,
+    })
+    stats['sharpe_ratio'] = (stats['avg_daily_roi'] - RISK_FREE_RATE) / stats['volatility']
+    # Composite score, 0 drawdowns (or volatility) leave it undefined
+    risk = (stats['volatility'] * stats['max_drawdown_percent'] / 100).replace(0, np.nan)
+    stats['score'] = stats['sharpe_ratio'] * stats['avg_daily_roi'] / risk
+    return stats
+
+
+def run():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('results', nargs='?', default='results/', help='directory of CSVs or a sweep results file')
+    parser.add_argument('--output', help='also write the summary to this CSV file')
+    parser.add_argument('--top', type=int, default=20)
+    args = parser.parse_args()
+
+    if os.path.isdir(args.results):
+        try:
+            trades = with_balance(load_csvs(args.results))
+        except ValueError as error:
+            parser.error(str(error))
+    else:
+        trades = with_balance(load_sweep(args.results), fees=False)
+    # The composite score is positive for losing sets too (negative Sharpe times negative ROI), so rank by Sharpe
+    stats = summary(trades).sort_values('sharpe_ratio', ascending=False)
+    with pd.option_context('display.max_colwidth', 80, 'display.width', 200):
+        print(stats.head(args.top).round(4).to_string())
+    if args.output:
+        stats.to_csv(args.output)
+
+
+if __name__ == '__main__':
+    run()
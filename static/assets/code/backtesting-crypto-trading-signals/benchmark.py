@@ -0,0 +1,155 @@
+# Throughput and memory of parsing a Telegram export: the previous format_data (json.load of the whole export, six
+# re.search calls per message, an indented JSON dump) against telegram.convert, on synthetic exports. Every parser
+# and size runs in a fresh process, so the peak memory (ru_maxrss) is its own. Both must find the same signals.
+# The extraction of the fields (six searches against one pass) is also timed alone, on already decoded messages.
+# Usage: python benchmark.py [--messages 100000 1000000]
+import argparse
+import itertools
+import json
+import os
+import random
+import re
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import telegram
+
+# Messages the extraction alone is timed on, decoded up front
+EXTRACTION_MESSAGES = 100000
+PAIRS = ("BTC", "ETH", "SOL", "XRP", "DOGE", "LINK", "AVAX", "ATOM")
+
+
+# A channel export: signals as formatted text, updates replying to them, and chatter
+def generate_export(path: str, count: int, seed: int = 42):
+    rng = random.Random(seed)
+    with open(path, "w") as file:
+        file.write('{\n "name": "Signals",\n "type": "public_channel",\n "id": 1,\n "messages": [\n')
+        for number in range(count):
+            message = {"id": number, "type": "message", "date": f"2023-{rng.randint(1, 12):02d}-"
+                       f"{rng.randint(1, 28):02d}T{rng.randint(0, 23):02d}:{rng.randint(0, 59):02d}:00"}
+            kind = rng.random()
+            if kind < 0.4:
+                price = round(rng.uniform(0.1, 50000), 4)
+                direction = rng.choice(("Long", "Short", "LONG", "short"))
+                message["text"] = [
+                    {"type": "hashtag", "text": f"#{rng.choice(PAIRS)}USDTPERP"},
+                    f" {direction} 📈\nLeverage: {rng.choice((5, 10, 20))}x\nEntry: {price}\n",
+                    *[f"Target {target}: {round(price * (1 + 0.01 * target), 4)}\n" for target in range(1, 5)],
+                    {"type": "bold", "text": f"Stop-loss: {round(price * 0.95, 4)}"},
+                ]
+            elif kind < 0.7:
+                message["reply_to_message_id"] = max(0, number - rng.randint(1, 50))
+                message["text"] = f"Target {rng.randint(1, 4)} reached ✅"
+            else:
+                message["text"] = "Market update: volatility ahead, manage your risk."
+            file.write(("," if number else "") + json.dumps(message, ensure_ascii=False) + "\n")
+        file.write(" ]\n}\n")
+
+
+# The signal of one message as format_data found it before telegram.py: six separate searches
+def previous_signal(trade: dict):
+    if "reply_to_message_id" in trade:
+        return None
+    combined_text = ""
+    for item in trade['text']:
+        if isinstance(item, dict) and "text" in item:
+            combined_text += item["text"]
+        elif isinstance(item, str):
+            combined_text += item
+    symbol_match = re.search(r"#(\w+)", combined_text)
+    symbol = symbol_match.group(1).replace('USDTPERP', '/USDT') if symbol_match else None
+    direction_match = re.search(r"(Long|Short)", combined_text, re.IGNORECASE)
+    direction = direction_match.group(1).capitalize() if direction_match else None
+    entry_price_match = re.search(r"Entry:\s([\d.]+)", combined_text)
+    entry_price = float(entry_price_match.group(1)) if entry_price_match else None
+    targets_matches = re.findall(r"Target\s\d\s*:\s([\d.]+)", combined_text)
+    r = 0.5
+    current_percentage = 1 / (1 + r + r ** 2 + r ** 3)
+    targets = []
+    for target in targets_matches:
+        targets.append({"price": float(target), "achieved": "no", "percentage": current_percentage})
+        current_percentage *= r
+    stop_loss_match = re.search(r"Stop-[Ll]oss:\s([\d.]+)", combined_text, re.IGNORECASE)
+    stop_loss = float(stop_loss_match.group(1)) if stop_loss_match else None
+    leverage_match = re.search(r"Leverage:\s(\d+)x", combined_text)
+    leverage = int(leverage_match.group(1)) if leverage_match else None
+    signal_time = trade.get("date")
+    if symbol and signal_time and direction and leverage and entry_price and stop_loss and targets:
+        return {"pair": symbol, "signal_time": signal_time, "direction": direction,
+                "leverage": leverage, "entry": {"price": entry_price, "achieved": "no"},
+                "stop_loss": {"price": stop_loss, "achieved": "no"}, "targets": targets}
+    return None
+
+
+# format_data before telegram.py
+def previous(export_path: str, signals_path: str) -> int:
+    with open(export_path, 'r') as file:
+        all_messages = json.load(file)
+    trade_list = [signal for signal in map(previous_signal, all_messages['messages']) if signal is not None]
+    with open(signals_path, 'w') as json_file:
+        json_file.write(json.dumps(trade_list, indent=4))
+    return len(all_messages['messages'])
+
+
+# Microseconds per message of extracting the signals of already decoded messages, without reading or writing
+def extraction(export_path: str, count: int) -> dict:
+    messages = list(itertools.islice(telegram.iter_messages(export_path), count))
+    signals, timings = {}, {}
+    for name, parse in (("previous", previous_signal), ("telegram", telegram.parse_signal)):
+        start = time.perf_counter()
+        signals[name] = [parse(message) for message in messages]
+        timings[name] = (time.perf_counter() - start) / len(messages) * 1e6
+    assert signals["previous"] == signals["telegram"], "the extractions found different signals"
+    return timings
+
+
+# Runs in the per-parser process
+def measure(parser: str, export_path: str, signals_path: str) -> dict:
+    start = time.perf_counter()
+    if parser == "previous":
+        messages = previous(export_path, signals_path)
+    else:
+        messages, _ = telegram.convert(export_path, signals_path)
+    seconds = time.perf_counter() - start
+    return {"messages": messages, "seconds": seconds,
+            "peak MiB": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}
+
+
+def run():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, nargs="+", default=[100000, 1000000])
+    parser.add_argument("--measure", nargs=3, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure:
+        print(json.dumps(measure(*args.measure)))
+        return
+
+    streaming = f"telegram ({'ijson' if telegram.ijson is not None else 'raw_decode'})"
+    with tempfile.TemporaryDirectory() as directory:
+        for count in args.messages:
+            export = os.path.join(directory, "export.json")
+            generate_export(export, count)
+            print(f"{count} messages, {os.path.getsize(export) / 1024 / 1024:.0f} MiB")
+            outputs = {}
+            for name in ("previous", "streaming"):
+                outputs[name] = os.path.join(directory, f"{name}.out")
+                output = subprocess.run([sys.executable, __file__, "--measure", name, export, outputs[name]],
+                                        check=True, capture_output=True, text=True).stdout
+                result = json.loads(output)
+                label = streaming if name == "streaming" else name
+                print(f"  {label:>22}: {result['messages'] / result['seconds']:>9,.0f} messages/s, "
+                      f"peak {result['peak MiB']:6.0f} MiB")
+            with open(outputs["previous"]) as file:
+                expected = json.load(file)
+            assert list(telegram.read_signals(outputs["streaming"])) == expected, "the parsers found different signals"
+            timings = extraction(export, EXTRACTION_MESSAGES)
+            print(f"  {'extraction':>22}: {timings['previous']:.2f} µs/message with six searches, "
+                  f"{timings['telegram']:.2f} µs/message with one pass")
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,255 @@
+# Local store of OHLCV candles, so a backtest downloads every candle only once.
+# The candles of a pair and timeframe live in one .npy file (rows of timestamp in ms, open, high, low, close,
+# volume, sorted by timestamp) that is memory-mapped on read, next to a .json file with the time ranges already
+# fetched, so ranges the exchange has no candles for aren't asked for again either. Only the missing parts of a
+# requested range are downloaded. Without an exchange the store serves what it has cached (offline runs).
+import json
+import math
+import os
+import time
+import zlib
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+try:
+    from ccxt.base.errors import BadSymbol
+except ImportError:
+    # Offline runs don't need ccxt
+    class BadSymbol(Exception):
+        pass
+
+# Where simulate_trades and sweep.py keep the candles
+DIRECTORY = 'data/candles'
+COLUMNS = ("timestamp", "open", "high", "low", "close", "volume")
+TIMESTAMP, OPEN, HIGH, LOW, CLOSE, VOLUME = range(len(COLUMNS))
+UNITS = {"m": 60_000, "h": 3_600_000, "d": 86_400_000, "w": 604_800_000}
+
+
+def timeframe_ms(timeframe: str) -> int:
+    return int(timeframe[:-1]) * UNITS[timeframe[-1]]
+
+
+# Milliseconds since the epoch of an ISO 8601 time, times without a timezone are UTC (like ccxt's parse8601)
+def parse8601(text: str) -> int:
+    moment = datetime.fromisoformat(text.replace("Z", "+00:00"))
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return int(moment.timestamp() * 1000)
+
+
+# Adds [start, end) to a sorted list of disjoint ranges
+def add_range(ranges: list, start: int, end: int) -> list:
+    merged = []
+    for low, high in sorted(ranges + [[start, end]]):
+        if merged and low <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], high)
+        else:
+            merged.append([low, high])
+    return merged
+
+
+# The parts of [start, end) that aren't covered by ranges
+def missing_ranges(ranges: list, start: int, end: int) -> list:
+    missing = []
+    for low, high in ranges:
+        if high <= start or low >= end:
+            continue
+        if low > start:
+            missing.append((start, low))
+        start = max(start, high)
+    if start < end:
+        missing.append((start, end))
+    return missing
+
+
+class CandleStore:
+    def __init__(self, directory: str, exchange=None, page_size: int = 1000):
+        self.directory = directory
+        self.exchange = exchange
+        self.page_size = page_size
+        self.downloaded = 0
+        self._arrays = {}
+        self._ranges = {}
+        os.makedirs(directory, exist_ok=True)
+        self._bad_symbols_path = os.path.join(directory, "bad_symbols.json")
+        self._bad_symbols = set()
+        if os.path.exists(self._bad_symbols_path):
+            with open(self._bad_symbols_path) as file:
+                self._bad_symbols = set(json.load(file))
+
+    # Like exchange.fetch_ohlcv(pair, timeframe, since, limit): the first `limit` closed candles from `since` on
+    def fetch(self, pair: str, timeframe: str, since: int, limit: int = 100) -> np.ndarray:
+        step = timeframe_ms(timeframe)
+        start = math.ceil(since / step) * step
+        return self.range(pair, timeframe, start, start + limit * step)[:limit]
+
+    # Candles opened in [start, end), raises BadSymbol for pairs the exchange doesn't list
+    def range(self, pair: str, timeframe: str, start: int, end: int) -> np.ndarray:
+        if pair in self._bad_symbols:
+            raise BadSymbol(pair)
+        step = timeframe_ms(timeframe)
+        # The current candle isn't closed yet, so it isn't stored
+        end = min(end, int(time.time() * 1000) // step * step)
+        key = (pair, timeframe)
+        if self.exchange is not None and missing_ranges(self._covered(key), start, end):
+            # Several processes can share a store (see sweep.py), each fetches what none of them has stored yet
+            with self._locked(key):
+                self._arrays.pop(key, None)
+                self._ranges.pop(key, None)
+                for low, high in missing_ranges(self._covered(key), start, end):
+                    candles, high = self._download(pair, timeframe, low, high)
+                    self._store(key, candles, low, high)
+        candles = self._candles(key)
+        timestamps = candles[:, TIMESTAMP]
+        return candles[np.searchsorted(timestamps, start):np.searchsorted(timestamps, end)]
+
+    # Candles from `start` until at least `end`, with the end of the range they cover. Pages are kept whole up to
+    # the last closed candle, so the windows right after this one are usually stored already.
+    def _download(self, pair: str, timeframe: str, start: int, end: int) -> tuple:
+        step = timeframe_ms(timeframe)
+        closed = int(time.time() * 1000) // step * step
+        pages = []
+        since = covered = start
+        while since < end:
+            try:
+                page = self.exchange.fetch_ohlcv(pair, timeframe, since, self.page_size)
+            except BadSymbol:
+                self._bad_symbols.add(pair)
+                self._write_json(self._bad_symbols_path, sorted(self._bad_symbols))
+                raise
+            if not page:
+                break
+            page = np.asarray(page, dtype=np.float64)
+            pages.append(page)
+            since = int(page[-1, TIMESTAMP]) + step
+            covered = max(covered, min(since, closed))
+        covered = max(covered, end)
+        if not pages:
+            return np.empty((0, len(COLUMNS))), covered
+        candles = np.concatenate(pages)
+        candles = candles[(candles[:, TIMESTAMP] >= start) & (candles[:, TIMESTAMP] < covered)]
+        self.downloaded += len(candles)
+        return candles, covered
+
+    def _store(self, key, candles: np.ndarray, start: int, end: int):
+        merged = np.concatenate([candles, self._candles(key)])
+        # Sorted by timestamp without duplicates, freshly downloaded candles win
+        _, first = np.unique(merged[:, TIMESTAMP], return_index=True)
+        merged = merged[first]
+        path = self._path(key)
+        temporary = f"{path}.{os.getpid()}.tmp"
+        with open(temporary, "wb") as file:
+            np.save(file, merged)
+        os.replace(temporary, path + ".npy")
+        self._arrays.pop(key, None)
+        self._ranges[key] = add_range(self._covered(key), start, end)
+        self._write_json(path + ".json", self._ranges[key])
+
+    def _candles(self, key) -> np.ndarray:
+        candles = self._arrays.get(key)
+        if candles is None:
+            path = self._path(key) + ".npy"
+            if os.path.exists(path):
+                candles = np.load(path, mmap_mode="r")
+            else:
+                candles = np.empty((0, len(COLUMNS)))
+            self._arrays[key] = candles
+        return candles
+
+    def _covered(self, key) -> list:
+        ranges = self._ranges.get(key)
+        if ranges is None:
+            path = self._path(key) + ".json"
+            ranges = []
+            if os.path.exists(path):
+                with open(path) as file:
+                    ranges = json.load(file)
+            self._ranges[key] = ranges
+        return ranges
+
+    @contextmanager
+    def _locked(self, key):
+        if fcntl is None:
+            yield
+            return
+        with open(self._path(key) + ".lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _path(self, key) -> str:
+        pair, timeframe = key
+        directory = os.path.join(self.directory, pair.replace("/", "-").replace(":", "-"))
+        os.makedirs(directory, exist_ok=True)
+        return os.path.join(directory, timeframe)
+
+    @staticmethod
+    def _write_json(path: str, value):
+        temporary = f"{path}.{os.getpid()}.tmp"
+        with open(temporary, "w") as file:
+            json.dump(value, file)
+        os.replace(temporary, path)
+
+
+# Deterministic synthetic candles for every pair, to run the simulator without network access. Prices follow a
+# smooth function of time per pair, and candles of larger timeframes are built from the 1m ones, so 1h and 1m
+# candles agree like they do on a real exchange. `latency` simulates the time of a request.
+class FakeExchange:
+    def __init__(self, pairs=None, latency: float = 0.0):
+        self.pairs = set(pairs) if pairs is not None else None
+        self.latency = latency
+        self.requests = 0
+
+    def fetch_ohlcv(self, symbol: str, timeframe: str = "1m", since: int = None, limit: int = None) -> list:
+        if self.pairs is not None and symbol not in self.pairs:
+            raise BadSymbol(symbol)
+        self.requests += 1
+        if self.latency:
+            time.sleep(self.latency)
+        step = timeframe_ms(timeframe)
+        limit = limit or 100
+        now = int(time.time() * 1000)
+        start = math.ceil(since / step) * step if since is not None else (now // step - limit) * step
+        limit = max(0, min(limit, (now // step * step - start) // step))
+        minutes = step // UNITS["m"]
+        # 1m candles, grouped into the requested timeframe
+        timestamps = start + np.arange(limit * minutes + 1, dtype=np.int64) * UNITS["m"]
+        prices = self.price(symbol, timestamps)
+        wiggle = self.noise(symbol, timestamps[:-1]) * prices[:-1] * 0.002
+        opens, closes = prices[:-1], prices[1:]
+        highs = np.maximum(opens, closes) + wiggle
+        lows = np.minimum(opens, closes) - wiggle
+        shape = (limit, minutes)
+        return np.column_stack([
+            timestamps[:-1:minutes][:limit].astype(np.float64),
+            opens.reshape(shape)[:, 0],
+            highs.reshape(shape).max(axis=1),
+            lows.reshape(shape).min(axis=1),
+            closes.reshape(shape)[:, -1],
+            np.full(limit, 1000.0),
+        ]).tolist()
+
+    def parse8601(self, text: str) -> int:
+        return parse8601(text)
+
+    @staticmethod
+    def price(symbol: str, timestamps: np.ndarray) -> np.ndarray:
+        phase = zlib.crc32(symbol.encode()) % 1000
+        hours = timestamps / UNITS["h"]
+        return 100 * (1 + 0.05 * np.sin(hours / 24 + phase) + 0.02 * np.sin(hours / 3 + 2 * phase)
+                      + 0.005 * np.sin(hours * 7 + phase))
+
+    @staticmethod
+    def noise(symbol: str, timestamps: np.ndarray) -> np.ndarray:
+        seed = zlib.crc32(symbol.encode()) % 1000
+        value = np.sin(timestamps / UNITS["m"] * 12.9898 + seed) * 43758.5453
+        return value - np.floor(value)
@@ -0,0 +1,157 @@
+# Entry, take-profit and stop-loss detection of simulate_trades on NumPy candle arrays.
+# Instead of walking candles row by row, every step searches the whole window at once for the first candle that
+# touches a price. Between two such touches nothing changes (same stop loss, same open targets), so a trade takes
+# one vectorized search per target hit instead of one Python iteration per candle.
+# Both directions use the same code: for Shorts prices and candles are negated, which turns "low <= target" into
+# "-low >= -target", the Long comparison.
+from datetime import datetime, timezone
+
+import numpy as np
+
+from candles import HIGH, LOW, TIMESTAMP, BadSymbol, parse8601
+
+# Candles per lookup, the default of bitget's fetch_ohlcv the results were made with
+WINDOW = 100
+
+
+def isoformat(timestamp: float) -> str:
+    return datetime.fromtimestamp(timestamp / 1000, timezone.utc).replace(tzinfo=None).isoformat()
+
+
+# Index of the first True in mask, -1 if there is none
+def first(mask: np.ndarray) -> int:
+    if not len(mask):
+        return -1
+    index = int(np.argmax(mask))
+    return index if mask[index] else -1
+
+
+# (favourable, adverse) price extremes of candles for a direction, in the sign convention of `sign`
+def extremes(candles: np.ndarray, sign: int):
+    if sign > 0:
+        return candles[:, HIGH], candles[:, LOW]
+    return -candles[:, LOW], -candles[:, HIGH]
+
+
+# Move the stop loss up the ladder as targets are hit: breakeven after the first, then the target before the last hit
+def trail_stop_loss(signal: dict):
+    hit = sum(target['achieved'] == 'yes' for target in signal['targets'])
+    if hit == 1:
+        signal['stop_loss']['price'] = signal['entry']['price']
+    elif 2 <= hit <= 4:
+        signal['stop_loss']['price'] = signal['targets'][hit - 2]['price']
+
+
+# Move the stop loss to the entry once the first target is hit, and leave it there
+def trail_to_breakeven(signal: dict):
+    if any(target['achieved'] == 'yes' for target in signal['targets']):
+        signal['stop_loss']['price'] = signal['entry']['price']
+
+
+def keep_stop_loss(signal: dict):
+    pass
+
+
+TRAILING = {"ladder": trail_stop_loss, "breakeven": trail_to_breakeven, "none": keep_stop_loss}
+
+
+# Marks the entry of signal as achieved at the first 1m candle from the signal time on that trades at the entry
+# price, searched in the 1h candles after the signal that do. `fetch(pair, timeframe, since)` returns candles.
+def check_entry(fetch, signal: dict) -> bool:
+    price = signal['entry']['price']
+    signal_time = parse8601(signal['signal_time'])
+    hours = fetch(signal['pair'], "1h", signal_time)
+    touched = (hours[:, LOW] <= price) & (price <= hours[:, HIGH])
+    for hour in hours[touched, TIMESTAMP]:
+        minutes = fetch(signal['pair'], "1m", int(hour))
+        index = first((minutes[:, LOW] <= price) & (price <= minutes[:, HIGH]) & (minutes[:, TIMESTAMP] >= signal_time))
+        if index >= 0:
+            signal['entry']['time_achieved'] = isoformat(minutes[index, TIMESTAMP])
+            signal['entry']['achieved'] = 'yes'
+            return True
+    return False
+
+
+# Follows the trade from its entry through the 1h candles until the stop loss is hit or all targets are.
+# Returns (closed, close time), with the targets and stop loss of signal marked as achieved. If one hour hits both
+# the stop loss and targets, the 1m candles decide which targets came first.
+def check_sl_or_tp(fetch, signal: dict, trail=trail_stop_loss):
+    sign = 1 if signal['direction'] == 'Long' else -1
+    hours = fetch(signal['pair'], "1h", parse8601(signal['entry']['time_achieved']))
+    favourable, adverse = extremes(hours, sign)
+    targets = signal['targets']
+    start = 0
+    while start < len(hours):
+        trail(signal)
+        open_targets = [target for target in targets if target['achieved'] == 'no']
+        if not open_targets:
+            return True, targets[-1]['time_achieved']
+        stop = signal['stop_loss']['price'] * sign
+        nearest = min(target['price'] * sign for target in open_targets)
+        sl_hit = adverse[start:] <= stop
+        tp_hit = favourable[start:] >= nearest
+        offset = first(sl_hit | tp_hit)
+        if offset < 0:
+            break
+        index = start + offset
+        hour_time = isoformat(hours[index, TIMESTAMP])
+        reached = [target for target in open_targets if favourable[index] >= target['price'] * sign]
+
+        if sl_hit[offset] and tp_hit[offset]:
+            minutes = fetch(signal['pair'], "1m", int(hours[index, TIMESTAMP]))
+            minute_favourable, minute_adverse = extremes(minutes, sign)
+            stop_index = first(minute_adverse <= stop)
+            # Only missing 1m candles make this happen, the hour's time is the best guess then
+            stop_time = isoformat(minutes[stop_index, TIMESTAMP]) if stop_index >= 0 else hour_time
+            for target in reached:
+                target_index = first(minute_favourable >= target['price'] * sign)
+                target_time = isoformat(minutes[target_index, TIMESTAMP]) if target_index >= 0 else hour_time
+                if stop_time > target_time:
+                    target['achieved'] = 'yes'
+                    target['time_achieved'] = target_time
+            signal['stop_loss']['achieved'] = 'yes'
+            signal['stop_loss']['time_achieved'] = stop_time
+            return True, stop_time
+
+        if sl_hit[offset]:
+            signal['stop_loss']['achieved'] = 'yes'
+            signal['stop_loss']['time_achieved'] = hour_time
+            return True, hour_time
+
+        for target in reached:
+            target['achieved'] = 'yes'
+            target['time_achieved'] = hour_time
+        start = index + 1
+    return False, None
+
+
+# Runs one signal: (closed, close time), or (False, None) if it wasn't entered or its pair isn't listed
+def simulate(fetch, signal: dict, trail=trail_stop_loss):
+    try:
+        if not check_entry(fetch, signal):
+            return False, None
+    except BadSymbol:
+        return False, None
+    return check_sl_or_tp(fetch, signal, trail)
+
+
+# ROI in percent of the margin of a simulated signal. `percentages` and `leverage` override the signal's.
+def calculate_roi(signal: dict, percentages: list = None, leverage: float = None) -> float:
+    entry_price = signal['entry']['price']
+    sign = 1 if signal['direction'] == 'Long' else -1
+    targets = signal['targets']
+    if percentages is None:
+        percentages = [target['percentage'] for target in targets]
+    total_percentage = 0.0
+
+    for target, percentage_sold in zip(targets, percentages):
+        if target['achieved'] == 'yes':
+            total_percentage += sign * ((target['price'] - entry_price) / entry_price) * 100 * percentage_sold
+
+    # The stop loss closes what's left, counted as the share of targets that weren't hit
+    if signal['stop_loss']['achieved'] == 'yes':
+        percentage_not_sold = len([target for target in targets if target['achieved'] == 'no']) / len(targets)
+        total_percentage += sign * ((signal['stop_loss']['price'] - entry_price) / entry_price) * 100 * \
+            percentage_not_sold
+
+    return round(total_percentage * (leverage or signal['leverage']), 2)
@@ -0,0 +1,213 @@
+# Checks engine.py against the row by row (iterrows) simulation it replaced, on synthetic signals and the candles of
+# candles.FakeExchange: every signal must end up with the same entry, targets, stop loss, close time and ROI.
+# The reference functions below are the old check_entry and check_sl_or_tp of simulate_trades, only with the
+# candle fetching passed in and the (unchanged) trail_stop_loss taken from engine.py. Exits with status 1 if any
+# signal differs.
+# Usage: python engine_check.py [--signals 300] [--seed 1]
+import argparse
+import copy
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+from candles import COLUMNS, BadSymbol, CandleStore, FakeExchange, parse8601
+from engine import WINDOW, calculate_roi, simulate, trail_stop_loss
+from targets import target_percentages
+
+PAIRS = ["BTC/USDT", "ETH/USDT", "SOL/USDT", "XRP/USDT"]
+# Signals of this pair aren't listed on the exchange
+UNLISTED = "BAD/USDT"
+
+
+# Signals around the fake prices, so most of them are entered and many hit targets and stop losses in one hour
+def generate_signals(count: int, seed: int) -> list:
+    rng = random.Random(seed)
+    start = datetime(2024, 1, 1)
+    signals = []
+    for _ in range(count):
+        pair = rng.choice(PAIRS + [UNLISTED])
+        signal_time = start + timedelta(minutes=rng.randint(0, 60 * 24 * 200))
+        price = float(FakeExchange.price(pair, np.array([parse8601(signal_time.isoformat())]))[0])
+        direction = rng.choice(["Long", "Short"])
+        sign = 1 if direction == "Long" else -1
+        entry = round(price * (1 - sign * rng.uniform(0, 0.01)), 4)
+        targets = [round(entry * (1 + sign * 0.004 * step * rng.uniform(0.5, 2)), 4) for step in range(1, 5)]
+        signals.append({
+            "pair": pair,
+            "signal_time": signal_time.isoformat(),
+            "direction": direction,
+            "leverage": 10,
+            "entry": {"price": entry, "achieved": "no"},
+            "stop_loss": {"price": round(entry * (1 - sign * rng.uniform(0.005, 0.03)), 4), "achieved": "no"},
+            "targets": [{"price": target, "achieved": "no", "percentage": percentage}
+                        for target, percentage in zip(targets, target_percentages(0.5, len(targets)))],
+        })
+    return signals
+
+
+def reference_fetch(store: CandleStore, pair: str, since: int, timeframe: str):
+    try:
+        ohlcv = store.fetch(pair, timeframe, since, WINDOW)
+    except BadSymbol:
+        return None
+    df = pd.DataFrame(ohlcv, columns=list(COLUMNS))
+    df['timestamp'] = pd.to_datetime(df['timestamp'], unit='ms')
+    return df
+
+
+def reference_check_entry(fetch_historical_data, signal):
+    entry_timestamps_1h = fetch_historical_data(signal['pair'], parse8601(signal['signal_time']), "1h")
+    if entry_timestamps_1h is None:
+        return False
+    for index, row in entry_timestamps_1h.iterrows():
+        if row['low'] <= signal["entry"]["price"] <= row['high']:
+            entry_timestamps_1m = fetch_historical_data(signal['pair'], parse8601(row['timestamp'].isoformat()), "1m")
+            for index, row in entry_timestamps_1m.iterrows():
+                if row['low'] <= signal["entry"]["price"] <= row['high']:
+                    if row['timestamp'].isoformat() >= signal["signal_time"]:
+                        signal["entry"]["time_achieved"] = row['timestamp'].isoformat()
+                        signal["entry"]["achieved"] = 'yes'
+                        return True
+    return False
+
+
+def reference_check_sl_or_tp(fetch_historical_data, signal):
+    timestamps_after_entry_1h = fetch_historical_data(signal['pair'], parse8601(signal['entry']['time_achieved']), "1h")
+    if timestamps_after_entry_1h is None:
+        return False, None
+
+    for index, row in timestamps_after_entry_1h.iterrows():
+        trail_stop_loss(signal)
+        targets = [target for target in signal["targets"] if target["achieved"] == "no"]
+        if not targets:
+            return True, signal["targets"][-1]["time_achieved"]
+
+        elif signal["direction"] == "Long":
+            sl_achieved = row['low'] <= signal["stop_loss"]["price"]
+            tp_achieved = any([row['high'] >= target["price"] for target in targets])
+
+            if sl_achieved and tp_achieved:
+                timestamps_after_entry_1m = fetch_historical_data(signal['pair'],
+                                                                  parse8601(row['timestamp'].isoformat()), "1m")
+                stop_loss_time = \
+                    timestamps_after_entry_1m[timestamps_after_entry_1m['low'] <= signal["stop_loss"]["price"]][
+                        'timestamp'].iloc[0].isoformat()
+                for target in targets:
+                    if row['high'] >= target["price"]:
+                        tp_time = timestamps_after_entry_1m[timestamps_after_entry_1m['high'] >= target["price"]][
+                            'timestamp'].iloc[0].isoformat()
+                    else:
+                        continue
+                    if stop_loss_time > tp_time:
+                        target["achieved"] = "yes"
+                        target["time_achieved"] = tp_time
+                signal["stop_loss"]["achieved"] = "yes"
+                signal["stop_loss"]["time_achieved"] = stop_loss_time
+                return True, stop_loss_time
+
+            elif sl_achieved:
+                signal["stop_loss"]["achieved"] = "yes"
+                signal["stop_loss"]["time_achieved"] = row['timestamp'].isoformat()
+                return True, signal["stop_loss"]["time_achieved"]
+
+            elif tp_achieved:
+                for target in targets:
+                    if row["high"] >= target["price"]:
+                        target["achieved"] = "yes"
+                        target["time_achieved"] = row['timestamp'].isoformat()
+
+        elif signal["direction"] == "Short":
+            sl_achieved = row['high'] >= signal["stop_loss"]["price"]
+            tp_achieved = any([row['low'] <= target['price'] for target in targets])
+
+            if sl_achieved and tp_achieved:
+                timestamps_after_entry_1m = fetch_historical_data(signal['pair'],
+                                                                  parse8601(row['timestamp'].isoformat()), "1m")
+                stop_loss_time = \
+                    timestamps_after_entry_1m[timestamps_after_entry_1m['high'] >= signal["stop_loss"]["price"]][
+                        'timestamp'].iloc[0].isoformat()
+                for target in signal["targets"]:
+                    for target in targets:
+                        if row['low'] <= target["price"]:
+                            tp_time = timestamps_after_entry_1m[timestamps_after_entry_1m['low'] <= target["price"]][
+                                'timestamp'].iloc[0].isoformat()
+                        else:
+                            continue
+                        if stop_loss_time > tp_time:
+                            target["achieved"] = "yes"
+                            target["time_achieved"] = tp_time
+                signal["stop_loss"]["achieved"] = "yes"
+                signal["stop_loss"]["time_achieved"] = stop_loss_time
+                return True, stop_loss_time
+
+            elif sl_achieved:
+                signal["stop_loss"]["achieved"] = "yes"
+                signal["stop_loss"]["time_achieved"] = row['timestamp'].isoformat()
+                return True, signal["stop_loss"]["time_achieved"]
+
+            elif tp_achieved:
+                for target in targets:
+                    if row["low"] <= target["price"]:
+                        target["achieved"] = "yes"
+                        target["time_achieved"] = row['timestamp'].isoformat()
+
+    return False, None
+
+
+def reference_simulate(fetch_historical_data, signal):
+    if not reference_check_entry(fetch_historical_data, signal):
+        return False, None
+    return reference_check_sl_or_tp(fetch_historical_data, signal)
+
+
+def run():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--signals", type=int, default=300)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    signals = generate_signals(args.signals, args.seed)
+    for signal in signals:
+        signal["signal_time"] = pd.to_datetime(signal["signal_time"]).isoformat()
+
+    with tempfile.TemporaryDirectory() as directory:
+        store = CandleStore(directory, FakeExchange(pairs=PAIRS))
+
+        def fetch(pair, timeframe, since):
+            return store.fetch(pair, timeframe, since, WINDOW)
+
+        def fetch_historical_data(pair, since, timeframe):
+            return reference_fetch(store, pair, since, timeframe)
+
+        # Download the candles first, so the timings below only compare the simulations
+        for signal in signals:
+            simulate(fetch, copy.deepcopy(signal))
+
+        timings = {}
+        outcomes = {}
+        for name, run_signal in (("iterrows", lambda signal: reference_simulate(fetch_historical_data, signal)),
+                                 ("engine", lambda signal: simulate(fetch, signal))):
+            simulated = copy.deepcopy(signals)
+            start = time.perf_counter()
+            results = [run_signal(signal) for signal in simulated]
+            timings[name] = time.perf_counter() - start
+            outcomes[name] = [(signal, result, calculate_roi(signal) if result[0] else None)
+                              for signal, result in zip(simulated, results)]
+
+    differences = [position for position, (expected, actual) in enumerate(zip(outcomes["iterrows"], outcomes["engine"]))
+                   if expected != actual]
+    closed = sum(1 for _, (closed, _), _ in outcomes["engine"] if closed)
+    print(f"{len(signals)} signals, {closed} closed: iterrows {timings['iterrows']:.2f} s, "
+          f"engine {timings['engine']:.2f} s, {len(differences)} differences")
+    for position in differences[:5]:
+        print(f"signal {position}:\n  iterrows {outcomes['iterrows'][position]}\n  engine   {outcomes['engine'][position]}")
+    return 1 if differences else 0
+
+
+if __name__ == "__main__":
+    sys.exit(run())
@@ -0,0 +1,206 @@
+# Parameter sweep of the backtest: runs the signals of trades/trades.ndjson with every strategy of GRID in a process
+# pool and writes all closed trades into one results file, keyed by strategy.
+# Which targets and stop loss a trade hits only depends on the trailing rule; the take-profit distribution,
+# leverage and fees only change what a closed trade earns. So every task simulates a chunk of signals once for a
+# trailing rule and prices the trades for all strategies with that rule. The workers share the candles through
+# the memory-mapped CandleStore files, only fetching what isn't cached yet (nothing with --offline).
+# Usage: python sweep.py [--workers 4] [--exchange bitget | --offline] [--output results/sweep.parquet]
+import argparse
+import itertools
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+
+from candles import DIRECTORY, CandleStore, FakeExchange
+from engine import TRAILING, WINDOW, calculate_roi, simulate
+from targets import target_percentages
+from telegram import read_signals
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+GRID = {
+    # Share of the position sold at each target relative to the one before (0.5 sells 53%, 27%, 13% and 7%)
+    "ratio": [0.25, 0.5, 0.75, 1.0],
+    "trailing": list(TRAILING),
+    # 0 keeps the leverage of the signal
+    "leverage": [0, 5, 10],
+    "taker_fee": [0.001],
+    "funding_fee": [0.0002],
+}
+# Funding is paid every 8h, trades last about a day on average
+FUNDING_CYCLES = 3
+RESULT_COLUMNS = ("strategy", *GRID, "signal", "pair", "direction", "close_time", "roi", "net_roi")
+
+
+def strategies(grid: dict) -> list:
+    return [dict(zip(grid, values)) for values in itertools.product(*grid.values())]
+
+
+def strategy_key(strategy: dict) -> str:
+    return ",".join(f"{name}={value}" for name, value in strategy.items())
+
+
+# Done/total, throughput and the time left (just done and throughput without a total), printed on one line at most
+# every `interval` seconds
+class Progress:
+    def __init__(self, total, unit: str, interval: float = 1.0, out=sys.stderr):
+        self.total = total
+        self.unit = unit
+        self.interval = interval
+        self.out = out
+        self.done = 0
+        self.started = self.printed = time.perf_counter()
+
+    def update(self, done: int = 1):
+        self.done += done
+        now = time.perf_counter()
+        if now - self.printed >= self.interval:
+            self.printed = now
+            self.out.write(f"\r{self.status(now)}")
+            self.out.flush()
+
+    def finish(self):
+        self.out.write(f"\r{self.status(time.perf_counter())}\n")
+
+    def status(self, now: float) -> str:
+        elapsed = now - self.started
+        rate = self.done / elapsed if elapsed else 0.0
+        if self.total is None:
+            return f"{self.done} {self.unit}, {rate:,.0f} {self.unit}/s, {elapsed:.0f}s elapsed"
+        left = (self.total - self.done) / rate if rate else 0.0
+        return (f"{self.done}/{self.total} {self.unit}, {rate:,.0f} {self.unit}/s, "
+                f"{elapsed:.0f}s elapsed, {left:.0f}s left")
+
+
+def count_signals(path: str) -> int:
+    return sum(1 for _ in read_signals(path))
+
+
+# The results as a DataFrame, from Parquet if pyarrow is installed and otherwise from a .npz file of the columns
+def load_results(path: str) -> pd.DataFrame:
+    if path.endswith(".npz"):
+        with np.load(path) as columns:
+            return pd.DataFrame({name: columns[name] for name in columns.files})
+    return pd.read_parquet(path)
+
+
+def write_results(results: pd.DataFrame, path: str) -> str:
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    if pyarrow is None or path.endswith(".npz"):
+        path = os.path.splitext(path)[0] + ".npz"
+        # Plain NumPy arrays (strings as unicode), so loading them needs no pickle
+        np.savez_compressed(path, **{name: np.array(results[name].tolist()) for name in results})
+    else:
+        results.to_parquet(path, index=False)
+    return path
+
+
+# State of a worker process, set up once by start_worker
+_store = None
+_signals_path = None
+
+
+# `exchange` is the name of a ccxt exchange, "fake" for candles.FakeExchange or None to only use cached candles
+def start_worker(candles_dir: str, signals_path: str, exchange: str):
+    global _store, _signals_path
+    if exchange == "fake":
+        exchange = FakeExchange()
+    elif exchange is not None:
+        import ccxt
+        exchange = getattr(ccxt, exchange)()
+    _store = CandleStore(candles_dir, exchange)
+    _signals_path = signals_path
+
+
+def fetch(pair: str, timeframe: str, since: int):
+    return _store.fetch(pair, timeframe, since, WINDOW)
+
+
+# Simulates signals[start:stop] with one trailing rule; returns the result columns and the number of signals
+def run_chunk(trailing: str, start: int, stop: int, chunk_strategies: list):
+    columns = {name: [] for name in RESULT_COLUMNS}
+    keys = [strategy_key(strategy) for strategy in chunk_strategies]
+    # Every task reads its own slice of the signals file, so no process holds all signals
+    for position, signal in enumerate(itertools.islice(read_signals(_signals_path), start, stop), start):
+        signal["signal_time"] = pd.Timestamp(signal["signal_time"]).isoformat()
+        closed, close_time = simulate(fetch, signal, TRAILING[trailing])
+        if not closed:
+            continue
+        for key, strategy in zip(keys, chunk_strategies):
+            leverage = strategy["leverage"] or signal["leverage"]
+            roi = calculate_roi(signal, target_percentages(strategy["ratio"], len(signal["targets"])), leverage)
+            # As in plot_graphs: funding on the leveraged position, the taker fee on the margin
+            costs = 100 * (leverage * strategy["funding_fee"] * FUNDING_CYCLES + strategy["taker_fee"])
+            columns["strategy"].append(key)
+            for name, value in strategy.items():
+                columns[name].append(value)
+            columns["signal"].append(position)
+            columns["pair"].append(signal["pair"])
+            columns["direction"].append(signal["direction"])
+            columns["close_time"].append(close_time)
+            columns["roi"].append(roi)
+            columns["net_roi"].append(round(roi - costs, 2))
+    return columns, stop - start
+
+
+def sweep(signals_path: str, candles_dir: str, workers: int, exchange: str = "bitget", grid: dict = GRID,
+          chunk_size: int = None) -> pd.DataFrame:
+    count = count_signals(signals_path)
+    all_strategies = strategies(grid)
+    rules = list(dict.fromkeys(strategy["trailing"] for strategy in all_strategies))
+    chunk_size = chunk_size or max(1, -(-count // (workers * 4)))
+    tasks = [(rule, start, min(count, start + chunk_size), [s for s in all_strategies if s["trailing"] == rule])
+             for rule in rules for start in range(0, count, chunk_size)]
+
+    print(f"{count} signals x {len(all_strategies)} strategies ({len(rules)} trailing rules), "
+          f"{len(tasks)} tasks on {workers} workers", file=sys.stderr)
+    progress = Progress(count * len(rules), "simulations")
+    parts = []
+    if workers == 1:
+        start_worker(candles_dir, signals_path, exchange)
+        for task in tasks:
+            columns, simulated = run_chunk(*task)
+            parts.append(columns)
+            progress.update(simulated)
+    else:
+        with ProcessPoolExecutor(workers, initializer=start_worker,
+                                 initargs=(candles_dir, signals_path, exchange)) as pool:
+            for future in as_completed([pool.submit(run_chunk, *task) for task in tasks]):
+                columns, simulated = future.result()
+                parts.append(columns)
+                progress.update(simulated)
+    progress.finish()
+
+    results = pd.DataFrame({name: list(itertools.chain.from_iterable(part[name] for part in parts))
+                            for name in RESULT_COLUMNS})
+    return results.sort_values(["strategy", "signal"], ignore_index=True)
+
+
+def run():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--signals", default="trades/trades.ndjson")
+    parser.add_argument("--candles", default=DIRECTORY)
+    parser.add_argument("--output", default="results/sweep.parquet")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--chunk-size", type=int, help="signals per task, default a quarter of a worker's share")
+    parser.add_argument("--exchange", default="bitget", help='ccxt exchange, or "fake" for synthetic candles')
+    parser.add_argument("--offline", action="store_true", help="only use cached candles")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    results = sweep(args.signals, args.candles, args.workers, None if args.offline else args.exchange,
+                    chunk_size=args.chunk_size)
+    path = write_results(results, args.output)
+    print(f"{len(results)} trades of {results['strategy'].nunique()} strategies written to {path} "
+          f"in {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    run()
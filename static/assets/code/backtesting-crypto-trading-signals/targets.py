@@ -0,0 +1,13 @@
+# Take-profit distribution of a signal, shared by the parser (telegram.py) and the simulator without pulling in
+# either's dependencies.
+
+
+# Share of the position sold at each of `count` targets, decreasing by `ratio` from one target to the next.
+# The shares of the first `terms` targets add up to 1, as the strategy was designed for 4 targets.
+def target_percentages(ratio: float, count: int, terms: int = 4) -> list:
+    percentages = []
+    percentage = 1 / sum(ratio ** term for term in range(terms))
+    for _ in range(count):
+        percentages.append(percentage)
+        percentage *= ratio
+    return percentages
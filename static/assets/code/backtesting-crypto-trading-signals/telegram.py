@@ -0,0 +1,174 @@
+# Streaming parser of Telegram chat exports (result.json of Telegram Desktop) into trade signals.
+# Messages are decoded one at a time while the export is read in chunks, with ijson if it's installed and
+# otherwise with json's raw_decode on a sliding buffer, so memory doesn't grow with the size of the export.
+# All fields of a signal but the direction come from one pass of SIGNAL_PATTERN over the text, and signals are
+# written as newline-delimited JSON, which simulate_trades and sweep.py read back one line at a time.
+# Usage: python telegram.py [data/telegram_data.json] [trades/trades.ndjson]
+import json
+import re
+import sys
+
+from targets import target_percentages
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+CHUNK_SIZE = 1024 * 1024
+# Common ratio of the exponentially decreasing share of the position sold per target
+RATIO = 0.5
+
+# One pass over the text finds the symbol, entry, targets, stop loss and leverage. Every alternative starts with
+# its own literal and each match consumes its field, so the scan doesn't try the alternatives again inside it.
+SIGNAL_PATTERN = re.compile(
+    r"#(\w+)"
+    r"|Entry:\s([\d.]+)"
+    r"|Target\s\d\s*:\s([\d.]+)"
+    r"|(?i:Stop-loss:\s)([\d.]+)"
+    r"|Leverage:\s(\d+)x"
+)
+# Searched on its own, as it may be part of another field (e.g. "#LONGUSDTPERP" is a Long too)
+DIRECTION_PATTERN = re.compile(r"long|short", re.IGNORECASE)
+
+
+# The messages of an export, decoded one by one
+def iter_messages(path: str, chunk_size: int = CHUNK_SIZE):
+    if ijson is not None:
+        with open(path, 'rb') as file:
+            yield from ijson.items(file, 'messages.item', use_float=True)
+        return
+    with open(path, encoding='utf-8') as file:
+        yield from _raw_messages(file, chunk_size)
+
+
+def _raw_messages(file, chunk_size: int):
+    decoder = json.JSONDecoder()
+    buffer, position, eof = "", 0, False
+
+    def read():
+        nonlocal buffer, position, eof
+        chunk = file.read(chunk_size)
+        eof = not chunk
+        buffer = buffer[position:] + chunk
+        position = 0
+
+    # The messages list is the value of the top-level "messages" key, after the chat's name, type and id
+    start = None
+    while start is None:
+        match = re.search(r'"messages"\s*:\s*\[', buffer)
+        if match:
+            start = match.end()
+        elif eof:
+            return
+        else:
+            # Keep the tail, the key may be split between two chunks
+            position = max(0, len(buffer) - 32)
+            read()
+    position = start
+
+    while True:
+        while position < len(buffer) and buffer[position] in ' \t\r\n,':
+            position += 1
+        if position == len(buffer):
+            if eof:
+                raise ValueError("Export ends inside the messages list")
+            read()
+            continue
+        if buffer[position] == ']':
+            return
+        try:
+            message, end = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError:
+            # Most likely a message cut off at the end of the buffer
+            if eof:
+                raise
+            read()
+            continue
+        yield message
+        position = end
+
+
+def message_text(message: dict) -> str:
+    text = message.get('text', '')
+    if isinstance(text, str):
+        return text
+    # Formatted text is a list of plain strings and entities like {"type": "hashtag", "text": "#BTCUSDTPERP"}
+    parts = []
+    for item in text:
+        if isinstance(item, dict) and "text" in item:
+            parts.append(item["text"])
+        elif isinstance(item, str):
+            parts.append(item)
+    return "".join(parts)
+
+
+# The trade signal in a message, None for replies and messages that don't have all of its fields
+def parse_signal(message: dict, ratio: float = RATIO):
+    if "reply_to_message_id" in message:
+        return None
+    text = message_text(message)
+    direction = DIRECTION_PATTERN.search(text)
+    symbol = entry = stop_loss = leverage = None
+    targets = []
+    # findall gives one tuple per match, with the field it matched set and the others empty
+    for symbol_found, entry_found, target, stop_loss_found, leverage_found in SIGNAL_PATTERN.findall(text):
+        if target:
+            targets.append(float(target))
+        elif symbol_found:
+            symbol = symbol or symbol_found
+        elif entry_found:
+            entry = entry or entry_found
+        elif stop_loss_found:
+            stop_loss = stop_loss or stop_loss_found
+        else:
+            leverage = leverage or leverage_found
+
+    signal_time = message.get("date")
+    if not (signal_time and direction and targets and symbol and entry and stop_loss and leverage):
+        return None
+    entry, stop_loss, leverage = float(entry), float(stop_loss), int(leverage)
+    if not (entry and stop_loss and leverage):
+        return None
+    return {
+        "pair": symbol.replace('USDTPERP', '/USDT'),
+        "signal_time": signal_time,
+        "direction": direction.group(0).capitalize(),
+        "leverage": leverage,
+        "entry": {"price": entry, "achieved": "no"},
+        "stop_loss": {"price": stop_loss, "achieved": "no"},
+        "targets": [{"price": price, "achieved": "no", "percentage": percentage}
+                    for price, percentage in zip(targets, target_percentages(ratio, len(targets)))],
+    }
+
+
+# Writes the signals of an export to an NDJSON file, returns (messages, signals)
+def convert(export_path: str, signals_path: str) -> tuple:
+    messages = signals = 0
+    with open(signals_path, 'w', encoding='utf-8') as output:
+        for message in iter_messages(export_path):
+            messages += 1
+            signal = parse_signal(message)
+            if signal is not None:
+                output.write(json.dumps(signal, separators=(',', ':')))
+                output.write('\n')
+                signals += 1
+    return messages, signals
+
+
+# The signals of an NDJSON file one by one; plain JSON lists (the old trades.json) are read whole
+def read_signals(path: str):
+    if path.endswith('.json'):
+        with open(path) as file:
+            yield from json.load(file)
+        return
+    with open(path, encoding='utf-8') as file:
+        for line in file:
+            if line.strip():
+                yield json.loads(line)
+
+
+if __name__ == '__main__':
+    source = sys.argv[1] if len(sys.argv) > 1 else 'data/telegram_data.json'
+    target = sys.argv[2] if len(sys.argv) > 2 else 'trades/trades.ndjson'
+    print("%d messages, %d signals" % convert(source, target))
@@ -0,0 +1,243 @@
+import json
+import logging
+import os
+import threading
+from contextlib import contextmanager
+from schema import decode_posts
+from snapshot import checksum, compact, save_cached, CACHE_PATH
+
+try:
+    import fcntl
+except ImportError:
+    # No file locks on Windows, fine for the single process development server
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+
+class ConflictError(Exception):
+    pass
+
+
+# Append-only log of the posts written through the app, one JSON line per write:
+# {"revision": <per-post revision>, "pushed": <already in n:point>, "post": {...}}.
+# It's shared by all workers through a file lock and compacted to the latest line per post once it grows.
+class Journal:
+    def __init__(self, path: str, compact_after: int = 200):
+        self.path = path
+        self.compact_after = compact_after
+
+    # Log a write of `post` (a dict, "id" None for a new post) and return the written entry.
+    # Raises ConflictError if the post has been written since `expected_revision`.
+    def append(self, post: dict, expected_revision: int = None, existing_ids=()) -> dict:
+        with self._locked() as entries:
+            latest = self._latest(entries)
+            if post["id"] is None:
+                ids = [post_id for post_id in list(existing_ids) + list(latest) if isinstance(post_id, int)]
+                post = dict(post, id=max(ids, default=0) + 1)
+            revision = latest[post["id"]]["revision"] if post["id"] in latest else 0
+            if expected_revision is not None and expected_revision != revision:
+                raise ConflictError(f"Post {post['id']} is at revision {revision}, not {expected_revision}")
+
+            entry = {"revision": revision + 1, "pushed": False, "post": post}
+            entries.append(entry)
+            if len(entries) > self.compact_after:
+                self._write(list(self._latest(entries).values()))
+            else:
+                with open(self.path, "a", encoding="utf-8") as file:
+                    file.write(json.dumps(entry) + "\n")
+            return entry
+
+    def revision(self, post_id) -> int:
+        if not os.path.exists(self.path):
+            return 0
+        with self._locked() as entries:
+            entry = self._latest(entries).get(post_id)
+        return entry["revision"] if entry else 0
+
+    # Latest entry of every post
+    def latest(self) -> list:
+        if not os.path.exists(self.path):
+            return []
+        with self._locked() as entries:
+            return list(self._latest(entries).values())
+
+    # Latest entry of every post that hasn't reached n:point yet
+    def pending(self) -> list:
+        return [entry for entry in self.latest() if not entry["pushed"]]
+
+    # Apply the pending writes to a list of post dicts: edits replace the post with the same id, new posts go first
+    def overlay(self, posts: list) -> list:
+        pending = {entry["post"]["id"]: entry["post"] for entry in self.pending()}
+        merged = [pending.pop(post["id"], post) for post in posts]
+        return [post for post in reversed(pending.values())] + merged
+
+    # Mark entries as pushed, up to the given revision per post id
+    def mark_pushed(self, revisions: dict):
+        with self._locked() as entries:
+            latest = list(self._latest(entries).values())
+            for entry in latest:
+                if entry["revision"] <= revisions.get(entry["post"]["id"], 0):
+                    entry["pushed"] = True
+            self._write(latest)
+
+    @contextmanager
+    def _locked(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(f"{self.path}.lock", "w") as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield self._read()
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _read(self) -> list:
+        try:
+            with open(self.path, "r", encoding="utf-8") as file:
+                return [json.loads(line) for line in file if line.strip()]
+        except FileNotFoundError:
+            return []
+
+    def _write(self, entries: list):
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            file.writelines(json.dumps(entry) + "\n" for entry in entries)
+        os.replace(tmp_path, self.path)
+
+    @staticmethod
+    def _latest(entries: list) -> dict:
+        latest = {}
+        for entry in entries:
+            latest[entry["post"]["id"]] = entry
+        return latest
+
+
+# Where writes end up besides the journal
+class RemoteBackend:
+    def fetch(self) -> list:
+        raise NotImplementedError
+
+    def publish(self, posts: list):
+        raise NotImplementedError
+
+
+# n:point replaces the whole bin on a POST to its api url
+class NpointBackend(RemoteBackend):
+    def __init__(self, url: str, timeout=(3.05, 10)):
+        self.url = url
+        self.timeout = timeout
+
+    def fetch(self) -> list:
+        import requests
+        response = requests.get(self.url, timeout=self.timeout)
+        response.raise_for_status()
+        return decode_posts(response.content)
+
+    def publish(self, posts: list):
+        import requests
+        response = requests.post(self.url, json=posts, timeout=self.timeout)
+        response.raise_for_status()
+
+
+# Pushes pending journal entries to the remote, `delay` seconds after the last write, so bursts of edits make one request.
+# The pending writes are applied on top of a fresh copy of the remote, so changes made directly in n:point are kept.
+class Publisher:
+    def __init__(self, backend: RemoteBackend, journal: Journal, store, delay: float = 5, cache_path: str = CACHE_PATH):
+        self.backend = backend
+        self.journal = journal
+        self.store = store
+        self.delay = delay
+        self.cache_path = cache_path
+        self._timer = None
+        self._lock = threading.Lock()
+
+    def schedule(self):
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+            self._timer = threading.Timer(self.delay, self._publish_logged)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def flush(self):
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        self.publish()
+
+    def publish(self):
+        pending = self.journal.pending()
+        if not pending:
+            return
+        posts = self.journal.overlay(self.backend.fetch())
+        self.backend.publish(posts)
+        self.journal.mark_pushed({entry["post"]["id"]: entry["revision"] for entry in pending})
+
+        payload = compact(posts)
+        self.store.replace(posts, checksum(payload))
+        save_cached(payload, self.cache_path)
+        logger.info("Published %d post(s) to the remote", len(pending))
+
+    def _publish_logged(self):
+        try:
+            self.publish()
+        except Exception:
+            logger.exception("Publishing to the remote failed, the writes stay in the journal")
+
+
+# Entry point for creating and editing posts: journal first, then the in-memory store, then (maybe) the remote.
+# Other processes (gunicorn workers) write to the same journal, `sync` applies their writes to this store.
+class PostWriter:
+    def __init__(self, store, journal: Journal, publisher: Publisher = None):
+        self.store = store
+        self.journal = journal
+        self.publisher = publisher
+        self._lock = threading.Lock()
+        # Journal revision of every post as it is in the store, which starts out with the journal applied
+        self._applied = {entry["post"]["id"]: entry["revision"] for entry in journal.latest()}
+
+    def create(self, fields: dict):
+        with self._lock:
+            entry = self.journal.append(dict(fields, id=None), existing_ids=self.store.by_id.keys())
+            post = self.store.add(entry["post"])
+            self._applied[post.id] = entry["revision"]
+        self._published()
+        return post
+
+    def update(self, post, expected_revision: int = None, **fields):
+        with self._lock:
+            entry = self.journal.append(dict(post.to_dict(), **fields), expected_revision)
+            self.store.update(post, **fields)
+            self._applied[post.id] = entry["revision"]
+        self._published()
+        return post
+
+    # Apply the journal entries this store doesn't have yet. Returns True if the store changed.
+    def sync(self) -> bool:
+        changed = False
+        with self._lock:
+            for entry in self.journal.latest():
+                data = entry["post"]
+                if entry["revision"] <= self._applied.get(data["id"], 0):
+                    continue
+                post = self.store.get_by_id(data["id"])
+                if post is None:
+                    self.store.add(data)
+                else:
+                    self.store.update(post, **{name: value for name, value in data.items() if name != "id"})
+                self._applied[data["id"]] = entry["revision"]
+                changed = True
+        if changed:
+            logger.info("Applied posts written by other processes from the journal")
+        return changed
+
+    # Revision of the post as the store has it, so an edit form pairs it with the body it shows
+    def revision(self, post_id) -> int:
+        return self._applied.get(post_id, 0)
+
+    def _published(self):
+        if self.publisher is not None:
+            self.publisher.schedule()
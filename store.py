@@ -0,0 +1,210 @@
+import mmap
+import os
+import threading
+import time
+from collections import OrderedDict
+import metrics
+from snapshot import checksum, compact
+
+
+# Same rule the templates have always used to build post urls
+def slugify(title: str) -> str:
+    return title.lower().replace(' ', '-')
+
+
+# Post bodies of one snapshot, concatenated in a blob file that is memory-mapped read-only.
+# Posts only keep their (offset, length) and bodies are decoded on demand, with the hottest ones kept in an LRU.
+class BodyStore:
+    def __init__(self, blob: bytes, path: str = None, cache_size: int = 128):
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._data = blob
+        if path is not None:
+            try:
+                self._data = self._map(blob, path)
+            except OSError:
+                # Not writable (e.g. a read-only deploy), keep the bodies in memory instead
+                pass
+
+    def get(self, offset: int, length: int) -> str:
+        with self._lock:
+            body = self._cache.get(offset)
+            if body is not None:
+                self._cache.move_to_end(offset)
+                metrics.BODY_CACHE_LOOKUPS.inc(result="hit")
+                return body
+        metrics.BODY_CACHE_LOOKUPS.inc(result="miss")
+        body = self._data[offset:offset + length].decode()
+        with self._lock:
+            self._cache[offset] = body
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return body
+
+    # Raw bytes of a body without touching the cache, for reading every body once (e.g. indexing)
+    def read(self, offset: int, length: int) -> bytes:
+        return self._data[offset:offset + length]
+
+    @staticmethod
+    def _map(blob: bytes, path: str):
+        # Blobs are named after their hash, so a blob written by another worker can be reused
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as file:
+                file.write(blob)
+            os.replace(tmp_path, path)
+            # Blobs of older snapshots stay readable for whoever still has them mapped
+            for name in os.listdir(os.path.dirname(path)):
+                if name.startswith("bodies-") and name.endswith(".bin") and name != os.path.basename(path):
+                    os.remove(os.path.join(os.path.dirname(path), name))
+        if not blob:
+            return blob
+        with open(path, "rb") as file:
+            return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+# Listing metadata of a post. The body lives in a BodyStore until the post is edited.
+class Post:
+    __slots__ = ("id", "title", "subtitle", "date", "author", "image_url", "slug", "_bodies", "_body_ref", "_body")
+
+    def __init__(self, data: dict, bodies: BodyStore = None, body_ref: tuple = None):
+        self.id = data["id"]
+        self.title = data["title"]
+        self.subtitle = data["subtitle"]
+        self.date = data["date"]
+        self.author = data["author"]
+        self.image_url = data["image_url"]
+        self.slug = slugify(self.title)
+        self._bodies = bodies
+        self._body_ref = body_ref
+        self._body = data["body"] if bodies is None else None
+
+    @property
+    def body(self) -> str:
+        if self._body is not None:
+            return self._body
+        return self._bodies.get(*self._body_ref)
+
+    @body.setter
+    def body(self, value: str):
+        self._body = value
+
+    def body_bytes(self) -> bytes:
+        if self._body is not None:
+            return self._body.encode()
+        return self._bodies.read(*self._body_ref)
+
+    # Changes whenever the body may have changed, without having to load it
+    @property
+    def body_key(self):
+        return self._body if self._body is not None else (id(self._bodies), self._body_ref)
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "title": self.title,
+            "subtitle": self.subtitle,
+            "date": self.date,
+            "author": self.author,
+            "image_url": self.image_url,
+            "body": self.body,
+        }
+
+
+# Holds the posts together with prebuilt slug -> post and id -> post lookups.
+# With a body_dir, bodies are kept out of the post records in a memory-mapped blob per snapshot.
+# content_hash is the hash of the snapshot the store was last built from.
+# Listeners added with on_change are called after every change, in the thread that made it.
+class PostStore:
+    def __init__(self, posts: list, body_dir: str = None, body_cache_size: int = 128):
+        self._lock = threading.Lock()
+        self._listeners = []
+        self.body_dir = body_dir
+        self.body_cache_size = body_cache_size
+        self.posts = []
+        self.by_slug = {}
+        self.by_id = {}
+        self.content_hash = None
+        self.version = 0
+        self.updated_at = time.time()
+        self.replace(posts)
+
+    # Swap in a new snapshot (a list of post dicts)
+    def replace(self, posts: list, content_hash: str = None):
+        content_hash = content_hash or checksum(compact(posts))
+        bodies, refs = self._bodies(posts)
+
+        records = [Post(post, bodies, ref) for post, ref in zip(posts, refs)]
+        by_slug, by_id = {}, {}
+        for post in records:
+            self._index(post, by_slug, by_id)
+        with self._lock:
+            self.posts, self.by_slug, self.by_id = records, by_slug, by_id
+            self.content_hash = content_hash
+            self.version += 1
+            self.updated_at = time.time()
+        self._changed()
+
+    # Add a new post (a dict) in front of the others
+    def add(self, data: dict) -> Post:
+        post = Post(data)
+        with self._lock:
+            self._index(post, self.by_slug, self.by_id)
+            self.posts = [post] + self.posts
+            self.version += 1
+            self.updated_at = time.time()
+        self._changed()
+        return post
+
+    def on_change(self, listener):
+        self._listeners.append(listener)
+
+    def _changed(self):
+        for listener in self._listeners:
+            listener()
+
+    def get_by_slug(self, slug: str):
+        return self.by_slug.get(slugify(slug))
+
+    def get_by_id(self, post_id: int):
+        return self.by_id.get(post_id)
+
+    def slug_for(self, post: Post) -> str:
+        return post.slug
+
+    # Apply changed fields to a post in place and keep the slug index consistent
+    def update(self, post: Post, **fields):
+        with self._lock:
+            if self.by_slug.get(post.slug) is post:
+                del self.by_slug[post.slug]
+            for name, value in fields.items():
+                setattr(post, name, value)
+            self._index(post, self.by_slug, self.by_id)
+            self.version += 1
+            self.updated_at = time.time()
+        self._changed()
+        return post
+
+    def _bodies(self, posts: list):
+        if self.body_dir is None:
+            return None, [None] * len(posts)
+        encoded = [post["body"].encode() for post in posts]
+        refs, offset = [], 0
+        for body in encoded:
+            refs.append((offset, len(body)))
+            offset += len(body)
+        blob = b"".join(encoded)
+        path = os.path.join(self.body_dir, f"bodies-{checksum(blob)}.bin")
+        return BodyStore(blob, path, self.body_cache_size), refs
+
+    @staticmethod
+    def _index(post: Post, by_slug: dict, by_id: dict):
+        # The first post with a title keeps the plain slug, like the old list scan did.
+        # Later posts with the same title get their id appended so they stay reachable.
+        post.slug = slugify(post.title)
+        if by_slug.get(post.slug, post) is not post:
+            post.slug = f"{post.slug}-{post.id}"
+        by_slug[post.slug] = post
+        by_id.setdefault(post.id, post)
@@ -0,0 +1,131 @@
+# Journal, PostWriter and Publisher: the code that writes posts. Run with `python -m pytest tests`.
+import json
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from snapshot import read_cached  # noqa: E402
+from storage import ConflictError, Journal, PostWriter, Publisher, RemoteBackend  # noqa: E402
+from store import PostStore  # noqa: E402
+
+
+def post(post_id, title, body="<p>Body</p>"):
+    return {"id": post_id, "title": title, "subtitle": "Subtitle", "date": "May 1, 2024", "author": "Author",
+            "image_url": "https://example.com/image.png", "body": body}
+
+
+def journal_lines(journal):
+    with open(journal.path, encoding="utf-8") as file:
+        return [json.loads(line) for line in file]
+
+
+# Stands in for n:point: holds the bin and records what was published
+class StubBackend(RemoteBackend):
+    def __init__(self, posts):
+        self.posts = posts
+        self.published = []
+
+    def fetch(self):
+        return [dict(remote) for remote in self.posts]
+
+    def publish(self, posts):
+        self.published.append(posts)
+        self.posts = posts
+
+
+@pytest.fixture
+def journal(tmp_path):
+    return Journal(str(tmp_path / "journal.jsonl"))
+
+
+def test_concurrent_appends_get_distinct_ids(journal):
+    with ThreadPoolExecutor(8) as pool:
+        entries = list(pool.map(lambda number: journal.append(post(None, f"New {number}"), existing_ids=[1, 2, 5]),
+                                range(40)))
+    assert sorted(entry["post"]["id"] for entry in entries) == list(range(6, 46))
+    assert all(entry["revision"] == 1 for entry in entries)
+
+
+def test_stale_revision_raises_conflict(journal):
+    journal.append(post(1, "First"))
+    journal.append(post(1, "Second"), expected_revision=1)
+    with pytest.raises(ConflictError):
+        journal.append(post(1, "Stale"), expected_revision=1)
+    assert journal.revision(1) == 2
+    assert journal.latest()[0]["post"]["title"] == "Second"
+
+
+def test_compaction_keeps_latest_revision_per_post(tmp_path):
+    journal = Journal(str(tmp_path / "journal.jsonl"), compact_after=4)
+    for number in range(4):
+        journal.append(post(1, f"Edit {number}"))
+    journal.append(post(2, "Other"))
+    lines = journal_lines(journal)
+    assert [(line["post"]["id"], line["revision"], line["post"]["title"]) for line in lines] == \
+        [(1, 4, "Edit 3"), (2, 1, "Other")]
+    journal.append(post(1, "Edit 4"))
+    assert len(journal_lines(journal)) == 3
+    assert journal.revision(1) == 5
+
+
+def test_overlay_puts_new_posts_first_and_replaces_edits(journal):
+    journal.append(post(2, "Edited two"))
+    journal.append(post(None, "Newer"), existing_ids=[1, 2])
+    journal.append(post(None, "Newest"), existing_ids=[1, 2])
+    merged = journal.overlay([post(2, "Two"), post(1, "One")])
+    assert [(merged_post["id"], merged_post["title"]) for merged_post in merged] == \
+        [(4, "Newest"), (3, "Newer"), (2, "Edited two"), (1, "One")]
+    # Pushed entries are in the remote already and aren't applied again
+    journal.mark_pushed({2: 1, 3: 1, 4: 1})
+    assert journal.overlay([post(2, "Two")]) == [post(2, "Two")]
+
+
+def test_sync_applies_writes_of_another_writer(journal):
+    posts = [post(2, "Two"), post(1, "One")]
+    first = PostWriter(PostStore(journal.overlay(posts)), journal)
+    second_store = PostStore(journal.overlay(posts))
+    second = PostWriter(second_store, journal)
+
+    created = first.create({key: value for key, value in post(None, "Created").items() if key != "id"})
+    first.update(first.store.get_by_id(1), expected_revision=first.revision(1), body="<p>Edited</p>")
+    assert second_store.get_by_id(created.id) is None
+
+    assert second.sync()
+    assert second_store.get_by_id(created.id).title == "Created"
+    assert second_store.posts[0].id == created.id
+    assert second_store.get_by_id(1).body == "<p>Edited</p>"
+    assert second.revision(1) == 1
+    assert not second.sync()
+
+    # An edit form loaded before the other writer's edit carries an older revision and is rejected
+    with pytest.raises(ConflictError):
+        second.update(second_store.get_by_id(1), expected_revision=0, body="<p>Stale</p>")
+    assert second_store.get_by_id(1).body == "<p>Edited</p>"
+
+
+def test_publish_applies_pending_writes_on_top_of_the_remote(journal, tmp_path):
+    store = PostStore([post(2, "Two"), post(1, "One")])
+    # Changed in n:point directly since the store was loaded
+    backend = StubBackend([post(2, "Two, changed remotely"), post(1, "One")])
+    cache_path = str(tmp_path / "cache" / "snapshot.json")
+    writer = PostWriter(store, journal, Publisher(backend, journal, store, delay=60, cache_path=cache_path))
+
+    writer.update(store.get_by_id(1), title="One, edited")
+    writer.create({key: value for key, value in post(None, "Three").items() if key != "id"})
+    writer.publisher.flush()
+
+    assert len(backend.published) == 1
+    assert [(published["id"], published["title"]) for published in backend.published[0]] == \
+        [(3, "Three"), (2, "Two, changed remotely"), (1, "One, edited")]
+    assert journal.pending() == []
+    assert [store_post.title for store_post in store.posts] == ["Three", "Two, changed remotely", "One, edited"]
+    assert read_cached(cache_path)[1] == backend.published[0]
+
+    # Nothing left to push
+    writer.publisher.flush()
+    assert len(backend.published) == 1